@@ -0,0 +1,306 @@
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Body
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse, FileResponse
+import uvicorn
+import flask_api
+from flask_api import (
+    load_users, load_workers, planner, user_tasks_lock, _live_columns,
+    versioned_payload, _build_tasks_response, _build_messages_response,
+    submit_assignment_job, credentials_known, register_user, login_scrape, record_login_scrape,
+    finish_login, login_from_snapshot, load_task_form, compiled_task_form, validate_task_form,
+    template_page,
+)
+from scraper import scraper_manager
+from form_cache import form_cache
+from form_compiler import compiled_forms
+from template_store import template_store
+from token_manager import token_manager
+from browser_scheduler import scheduler
+import board_events
+import readiness
+import resource_policy
+import assignment_worker
+
+# ASGI entry point serving the same routes as flask_api with async handlers:
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+# The scraper pool runs on the server's own event loop, so login scrapes are
+# awaited in place and /events streams park coroutines instead of threads.
+# Board state lives in this process, so run a single worker. Blocking work
+# (fmsapi calls via requests, JSON files) goes to the default thread pool.
+
+STATIC_DIR = flask_api.app.static_folder
+
+
+@asynccontextmanager
+async def lifespan(app):
+    scraper_manager.attach_loop(asyncio.get_running_loop())
+    yield
+    await scraper_manager.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+
+
+def error(message, status=400, **extra):
+    return JSONResponse({'error': message, **extra}, status_code=status)
+
+
+def etag_matcher(request):
+    """If-None-Match test equivalent to Werkzeug's for the weak/strong tags we issue."""
+    header = request.headers.get('if-none-match', '')
+    tags = {t.strip().removeprefix('W/').strip('"') for t in header.split(',') if t.strip()}
+    return lambda etag: '*' in tags or etag in tags
+
+
+def versioned(request, endpoint, username, build):
+    since = request.query_params.get('since')
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        since = None
+    etag, version, body = versioned_payload(endpoint, username, build, since, etag_matcher(request))
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache', 'X-Board-Version': str(version)}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+@app.get('/events')
+async def board_event_stream(request: Request, username: str = None, last_event_id: str = None):
+    if not username:
+        return error('Username required')
+    last_event_id = request.headers.get('last-event-id') or last_event_id
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    def snapshot_event():
+        with user_tasks_lock:
+            event_id = board_events.hub.last_id(username)
+            columns = {name: list(tasks) for name, tasks in _live_columns(username).items()}
+        return event_id, board_events.format_sse(event_id, 'snapshot', json.dumps({'columns': columns}))
+
+    async def stream():
+        cursor = last_event_id
+        board_events.hub.subscribe(username)
+        planner.wake()
+        try:
+            if cursor is None or board_events.hub.events_since(username, cursor) is None:
+                cursor, payload = snapshot_event()
+                yield payload
+            while True:
+                events = await board_events.hub.wait_async(username, cursor, board_events.HEARTBEAT_INTERVAL)
+                if events is None:
+                    cursor, payload = snapshot_event()
+                    yield payload
+                    continue
+                if not events:
+                    yield board_events.heartbeat()
+                    continue
+                for event_id, event_type, data in events:
+                    yield board_events.format_sse(event_id, event_type, json.dumps(data))
+                    cursor = event_id
+        finally:
+            board_events.hub.unsubscribe(username)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.get('/check_new_tasks')
+async def check_new_tasks(request: Request, username: str = None):
+    if not username:
+        return error('Username required')
+    return versioned(request, 'tasks', username, _build_tasks_response)
+
+
+@app.get('/check_task_messages')
+async def check_task_messages(request: Request, username: str = None):
+    if not username:
+        return error('Username required')
+    return versioned(request, 'messages', username, _build_messages_response)
+
+
+@app.post('/login')
+async def login(data: dict = Body(...)):
+    try:
+        username = data.get('username')
+        password = data.get('password')
+        if not username or not password:
+            return JSONResponse({'success': False, 'error': 'Username and password required'}, status_code=400)
+        if not await asyncio.to_thread(credentials_known, username, password):
+            if not await scraper_manager.verify_login(username, password):
+                return JSONResponse({'success': False, 'error': 'Invalid username or password'}, status_code=401)
+            await asyncio.to_thread(register_user, username, password)
+        body = await asyncio.to_thread(login_from_snapshot, username, password)
+        if body is None:
+            version_before = flask_api.board_versions.get(username)
+            await login_scrape(username, password)
+            await asyncio.to_thread(record_login_scrape, username, version_before)
+            columns = await asyncio.to_thread(finish_login, username)
+            body = {'success': True, 'columns': columns, 'snapshot_age': 0, 'refreshing': False}
+        return body
+    except Exception as e:
+        print(f"[ERROR] Exception in /login: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+
+@app.post('/add_technician')
+async def add_technician(data: dict = Body(...)):
+    task_uuid = data.get('task_uuid')
+    worker_name = data.get('worker_name')
+    missing = [field for field, value in (('task_uuid', task_uuid), ('worker_name', worker_name)) if not value]
+    if missing:
+        return error(f"Missing required field(s): {', '.join(missing)}", received=data)
+    body, status = submit_assignment_job([(task_uuid, worker_name)], data.get('username'))
+    return JSONResponse(body, status_code=status)
+
+
+@app.post('/api/add_technicians')
+async def add_technicians_batch(data: dict = Body(default={})):
+    assignments = []
+    for i, item in enumerate(data.get('assignments') or []):
+        task_uuid = item.get('task_uuid') if isinstance(item, dict) else None
+        names = (item.get('worker_names') or [item.get('worker_name')]) if task_uuid else []
+        names = [n for n in names if n]
+        if not task_uuid or not names:
+            return error(f"Assignment {i} needs task_uuid and worker_name or worker_names", received=item)
+        assignments.extend((task_uuid, name) for name in names)
+    if not assignments:
+        return error('Missing required field: assignments')
+    body, status = submit_assignment_job(assignments, data.get('username'))
+    return JSONResponse(body, status_code=status)
+
+
+@app.api_route('/api/jobs/{job_id}', methods=['GET', 'DELETE'])
+async def assignment_job_status(request: Request, job_id: str):
+    job = assignment_worker.get_job(job_id)
+    if not job:
+        return error('Unknown job', 404)
+    if request.method == 'DELETE' and not job.cancel():
+        return error(f"Job already {job.status}", 409, job=job.to_dict())
+    return job.to_dict()
+
+
+@app.get('/api/form/{task_id}')
+async def get_task_form(task_id: str, username: str = None):
+    # Token refresh and the fmsapi call block; keep them off the event loop
+    body, status, cache_state = await asyncio.to_thread(load_task_form, task_id, username or None)
+    headers = {'X-Form-Cache': cache_state} if cache_state else None
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+@app.get('/api/form/{task_id}/compiled')
+async def get_compiled_task_form(task_id: str, username: str = None):
+    body, status, cache_state = await asyncio.to_thread(compiled_task_form, task_id, username or None)
+    headers = {'X-Form-Cache': cache_state} if cache_state else None
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+@app.post('/api/form/{task_id}/validate')
+async def post_validate_task_form(task_id: str, username: str = None, data: dict = Body(default={})):
+    body, status = await asyncio.to_thread(
+        validate_task_form, task_id, data.get('formData'), data.get('username') or username or None)
+    return JSONResponse(body, status_code=status)
+
+
+@app.get('/api/workers')
+async def get_workers():
+    return await asyncio.to_thread(load_workers)
+
+
+@app.get('/api/scrape-plan')
+async def get_scrape_plan():
+    users = await asyncio.to_thread(load_users)
+    return planner.snapshot([u['username'] for u in users])
+
+
+@app.get('/api/readiness')
+async def get_readiness_stats():
+    return readiness.stats()
+
+
+@app.get('/api/scheduler')
+async def get_scheduler_metrics():
+    return scheduler.metrics()
+
+
+@app.get('/api/assignment-workers')
+async def get_assignment_workers():
+    return assignment_worker.stats()
+
+
+@app.get('/api/resource-stats')
+async def get_resource_stats():
+    return resource_policy.stats()
+
+
+@app.get('/api/tokens')
+async def get_token_stats():
+    return token_manager.stats()
+
+
+@app.get('/api/form-cache')
+async def get_form_cache_stats():
+    return dict(form_cache.stats(), compiled=compiled_forms.stats())
+
+
+@app.post('/api/save-form-template')
+async def save_form_template(data: dict = Body(...)):
+    task_id = data.get('taskId')
+    form_data = data.get('formData')
+    if not task_id or not form_data:
+        return error('Missing taskId or formData')
+    try:
+        return {'success': True, **await asyncio.to_thread(template_store.save, task_id, form_data)}
+    except Exception as e:
+        return error(str(e), 500)
+
+
+@app.get('/api/list-form-templates')
+async def list_form_templates(offset: int = 0, limit: int = None, prefix: str = None):
+    return template_page(offset, limit, prefix)
+
+
+@app.get('/api/form-template/{filename}')
+async def get_form_template(request: Request, filename: str):
+    if not filename.endswith('.json'):
+        return error('Not found', 404)
+    name = filename[:-len('.json')]
+    etag = template_store.etag(name)
+    if etag and etag_matcher(request)(etag):
+        return Response(status_code=304, headers={'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+    found = await asyncio.to_thread(template_store.get, name)
+    if found is None:
+        return error('Not found', 404)
+    body, etag = found
+    return Response(body, media_type='application/json', headers={'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+
+
+@app.get('/api/template-store')
+async def get_template_store_stats():
+    return template_store.stats()
+
+
+# --- CATCH-ALL ROUTE FOR REACT SPA ---
+@app.get('/{path:path}')
+async def serve_react(path: str):
+    file_path = os.path.realpath(os.path.join(STATIC_DIR, path))
+    if path and file_path.startswith(os.path.realpath(STATIC_DIR) + os.sep) and os.path.isfile(file_path):
+        return FileResponse(file_path)
+    index = os.path.join(STATIC_DIR, 'index.html')
+    if not os.path.isfile(index):
+        return error('Not found', 404)
+    return FileResponse(index)
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,305 @@
+import os
+import time
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from playwright.sync_api import sync_playwright
+import session_cache
+from browser_scheduler import scheduler, INTERACTIVE
+from add_technician import start_browser, sso_login, login, assign_task
+
+# Long-lived assignment worker: one thread per FMS account keeps a logged-in
+# page open and takes add-technician jobs from a queue, so a dispatcher click
+# costs the task page and team editor only, not interpreter + Chromium
+# startup and SSO.
+
+# Recycle the browser after this many seconds or jobs to keep memory bounded
+ASSIGN_BROWSER_MAX_AGE = int(os.environ.get("ASSIGN_BROWSER_MAX_AGE", 3600))
+ASSIGN_BROWSER_MAX_JOBS = int(os.environ.get("ASSIGN_BROWSER_MAX_JOBS", 200))
+# Close the browser after this long without jobs; the next job reopens it
+ASSIGN_IDLE_TIMEOUT = int(os.environ.get("ASSIGN_IDLE_TIMEOUT", 900))
+# Per-task budget; a job's deadline is this times its number of tasks
+ASSIGN_JOB_TIMEOUT = int(os.environ.get("ASSIGN_JOB_TIMEOUT", 180))
+# Jobs waiting per account before submissions are refused
+ASSIGN_MAX_QUEUED = int(os.environ.get("ASSIGN_MAX_QUEUED", 50))
+# Finished jobs kept for status lookups
+JOB_HISTORY = int(os.environ.get("ASSIGN_JOB_HISTORY", 500))
+
+
+class AssignmentJob:
+    """One queued assignment request: status, timestamps and per-pair results.
+
+    Status goes queued -> running -> done | failed | cancelled | timeout.
+    """
+
+    def __init__(self, groups, timeout=ASSIGN_JOB_TIMEOUT, on_update=None):
+        # [(task_uuid, [worker_name, ...])], one Save per task
+        self.id = uuid.uuid4().hex
+        self.groups = groups
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.deadline = self.created_at + timeout
+        self.result = None
+        self.cancel_requested = threading.Event()
+        self.on_update = on_update
+        self.future = Future()
+        self._lock = threading.Lock()
+
+    def items(self):
+        return [(task_uuid, name) for task_uuid, names in self.groups for name in names]
+
+    def failed(self, error):
+        return {
+            "success": False,
+            "error": error,
+            "duration": 0,
+            "results": [{"task_uuid": t, "worker_name": n, "success": False, "error": error} for t, n in self.items()],
+        }
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "assignments": [{"task_uuid": t, "worker_name": n} for t, n in self.items()],
+            "result": self.result,
+        }
+
+    def transition(self, from_states, status, result=None):
+        """Move to status if currently in from_states; False when another transition won."""
+        with self._lock:
+            if self.status not in from_states:
+                return False
+            self.status = status
+            if status == "running":
+                self.started_at = time.time()
+            else:
+                self.finished_at = time.time()
+                self.result = result
+        if status not in ("queued", "running"):
+            self.future.set_result(result)
+        if self.on_update:
+            try:
+                self.on_update(self.to_dict())
+            except Exception as e:
+                print(f"[Assign] Job update callback failed for {self.id}: {e}", flush=True)
+        return True
+
+    def cancel(self):
+        """Cancel a queued job outright; a running job stops before its next task."""
+        if self.transition(("queued",), "cancelled", self.failed("Cancelled")):
+            return True
+        if self.status == "running":
+            self.cancel_requested.set()
+            return True
+        return False
+
+
+def group_assignments(assignments):
+    """[(task_uuid, worker_name)] -> [(task_uuid, [worker_name, ...])] in first-seen order."""
+    groups = {}
+    for task_uuid, worker_name in assignments:
+        names = groups.setdefault(task_uuid, [])
+        if worker_name not in names:
+            names.append(worker_name)
+    return list(groups.items())
+
+
+class AssignmentWorker(threading.Thread):
+    def __init__(self, username, password):
+        super().__init__(name=f"assign-{username}", daemon=True)
+        self.username = username
+        self.password = password
+        self.jobs = queue.Queue(maxsize=ASSIGN_MAX_QUEUED)
+        self.playwright = None
+        self.browser = None
+        self.page = None
+        self.browser_started_at = 0
+        self.browser_jobs = 0
+
+    def submit(self, task_uuid, worker_name, on_update=None):
+        """Queue one assignment; see submit_batch."""
+        return self.submit_batch([(task_uuid, worker_name)], on_update)
+
+    def submit_batch(self, assignments, on_update=None):
+        """Queue (task_uuid, worker_name) pairs to run back to back in this worker's session.
+
+        Workers sharing a task are ticked together before one Save. Returns the
+        AssignmentJob; its result has one {task_uuid, worker_name, success, error}
+        entry per pair. Raises queue.Full when ASSIGN_MAX_QUEUED jobs are waiting.
+        """
+        groups = group_assignments(assignments)
+        job = AssignmentJob(groups, timeout=ASSIGN_JOB_TIMEOUT * len(groups), on_update=on_update)
+        # Registered first so a worker that picks the job up at once can always be looked up
+        _register(job)
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with _jobs_lock:
+                _jobs.pop(job.id, None)
+            raise
+        return job
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def run(self):
+        try:
+            self._serve()
+        except Exception as e:
+            print(f"[Assign] Worker for {self.username} crashed: {e}", flush=True)
+            # Fail whatever is still queued; get_worker() starts a fresh thread next time
+            while True:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job.transition(("queued",), "failed", job.failed(str(e)))
+
+    def _serve(self):
+        with sync_playwright() as p:
+            self.playwright = p
+            while True:
+                try:
+                    job = self.jobs.get(timeout=ASSIGN_IDLE_TIMEOUT)
+                except queue.Empty:
+                    if self.browser:
+                        print(f"[Assign] {self.username} idle for {ASSIGN_IDLE_TIMEOUT}s, closing browser.", flush=True)
+                        self._close_browser()
+                    continue
+                if job is None:
+                    break
+                if time.time() > job.deadline:
+                    job.transition(("queued",), "timeout", job.failed("Timed out while queued"))
+                    continue
+                if not job.transition(("queued",), "running"):
+                    continue
+                self._run_job(job)
+            self._close_browser()
+
+    def _run_job(self, job):
+        started = time.monotonic()
+        print(f"[Assign] {self.username}: {len(job.items())} assignment(s) on {len(job.groups)} task(s) "
+              f"(queued {time.time() - job.created_at:.1f}s)", flush=True)
+        results = []
+        stopped = None
+        for task_uuid, worker_names in job.groups:
+            if not stopped and job.cancel_requested.is_set():
+                stopped = "cancelled"
+            elif not stopped and time.time() > job.deadline:
+                stopped = "timeout"
+            if stopped:
+                error = "Cancelled" if stopped == "cancelled" else "Timed out"
+                results.extend({"task_uuid": task_uuid, "worker_name": n, "success": False, "error": error} for n in worker_names)
+                continue
+            try:
+                with scheduler.slot("assignment", self.username, INTERACTIVE):
+                    self._ensure_session()
+                    saved = assign_task(self.page, task_uuid, worker_names, self.username, self.password,
+                                        open_board=self._open_board)
+                self.browser_jobs += 1
+                errors = {n: None if saved.get(n) else f"Could not assign {n} to task {task_uuid}" for n in worker_names}
+            except Exception as e:
+                # Drop the browser; the next task starts from a fresh one
+                print(f"[Assign] Task {task_uuid} failed, dropping browser: {e}", flush=True)
+                self._close_browser()
+                errors = {n: str(e) for n in worker_names}
+            for name in worker_names:
+                results.append({"task_uuid": task_uuid, "worker_name": name, "success": errors[name] is None, "error": errors[name]})
+            print(f"[Assign] {task_uuid}: {sum(errors[n] is None for n in worker_names)}/{len(worker_names)} saved", flush=True)
+        duration = round(time.monotonic() - started, 2)
+        failed = [r for r in results if not r["success"]]
+        print(f"[Assign] {len(results) - len(failed)}/{len(results)} assignment(s) ok in {duration}s", flush=True)
+        result = {
+            "success": not failed,
+            "error": None if not failed else failed[0]["error"] if len(results) == 1 else f"{len(failed)} of {len(results)} assignments failed",
+            "duration": duration,
+            "results": results,
+        }
+        job.transition(("running",), stopped or ("done" if not failed else "failed"), result)
+
+    def _open_board(self):
+        # login() re-runs SSO itself if the board redirects there
+        login(self.page, self.username, self.password, restored=True)
+
+    def _ensure_session(self):
+        """Open (or reopen) a logged-in page; re-login only when the session is gone."""
+        expired = (
+            time.time() - self.browser_started_at > ASSIGN_BROWSER_MAX_AGE
+            or self.browser_jobs >= ASSIGN_BROWSER_MAX_JOBS
+        )
+        if self.browser and (expired or self.page.is_closed() or not self.browser.is_connected()):
+            self._close_browser()
+        if not self.browser:
+            self.browser, _, self.page, restored = start_browser(self.playwright, self.username)
+            self.browser_started_at = time.time()
+            self.browser_jobs = 0
+            if not restored:
+                sso_login(self.page, self.username, self.password)
+        elif session_cache.is_sso_url(self.page.url):
+            sso_login(self.page, self.username, self.password)
+
+    def _close_browser(self):
+        if self.browser:
+            try:
+                self.browser.close()
+            except Exception as e:
+                print(f"[Assign] Error closing browser for {self.username}: {e}", flush=True)
+        self.browser = None
+        self.page = None
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def _register(job):
+    with _jobs_lock:
+        _jobs[job.id] = job
+        # Drop the oldest finished jobs beyond JOB_HISTORY; live ones always stay
+        excess = len(_jobs) - JOB_HISTORY
+        for job_id in list(_jobs):
+            if excess <= 0:
+                break
+            if _jobs[job_id].status not in ("queued", "running"):
+                del _jobs[job_id]
+                excess -= 1
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def get_worker(username, password):
+    """The running worker for username, started on first use or after it died."""
+    with _workers_lock:
+        worker = _workers.get(username)
+        if worker is None or not worker.is_alive():
+            worker = AssignmentWorker(username, password)
+            worker.start()
+            _workers[username] = worker
+        worker.password = password
+        return worker
+
+
+def stats():
+    return {
+        username: {
+            "alive": worker.is_alive(),
+            "queued": worker.jobs.qsize(),
+            "max_queued": ASSIGN_MAX_QUEUED,
+            "browser_open": worker.browser is not None,
+            "browser_jobs": worker.browser_jobs,
+        }
+        for username, worker in list(_workers.items())
+    }
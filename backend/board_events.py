@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+# Per-user board change log feeding the /events Server-Sent Events stream.
+# Events carry monotonically increasing ids so a reconnecting client can
+# resume with Last-Event-ID instead of refetching the whole board. Like
+# flask_api.VERSION_BASE, ids start from a per-process base so an id handed
+# out before a restart is recognisably stale and gets a snapshot instead.
+
+EVENT_ID_BASE = int(time.time() * 1000)
+EVENT_HISTORY = 1000
+HEARTBEAT_INTERVAL = 15
+
+
+class BoardEventHub:
+    def __init__(self, history=EVENT_HISTORY):
+        self.history = history
+        self._cond = threading.Condition()
+        self._events = {}
+        self._last_id = {}
+        self._async_waiters = {}  # username -> {(loop, asyncio.Event)}
+        self.subscribers = {}
+
+    def publish(self, username, event_type, data):
+        with self._cond:
+            event_id = self._last_id.get(username, EVENT_ID_BASE) + 1
+            self._last_id[username] = event_id
+            events = self._events.setdefault(username, deque(maxlen=self.history))
+            events.append((event_id, event_type, data))
+            self._cond.notify_all()
+            for loop, wake in self._async_waiters.get(username, ()):
+                loop.call_soon_threadsafe(wake.set)
+            return event_id
+
+    def last_id(self, username):
+        with self._cond:
+            return self._last_id.get(username, EVENT_ID_BASE)
+
+    def _stale(self, username, last_id):
+        """True when last_id was not issued by this process; caller holds _cond."""
+        return last_id < EVENT_ID_BASE or last_id > self._last_id.get(username, EVENT_ID_BASE)
+
+    def events_since(self, username, last_id):
+        """Events after last_id, or None when the client must resync (history dropped, or id from another process)."""
+        with self._cond:
+            if self._stale(username, last_id):
+                return None
+            events = self._events.get(username)
+            if not events or last_id == self._last_id[username]:
+                return []
+            if events[0][0] > last_id + 1:
+                return None
+            return [e for e in events if e[0] > last_id]
+
+    def wait(self, username, last_id, timeout):
+        """Block until there are events after last_id or timeout expires."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._stale(username, last_id) and self._last_id.get(username, EVENT_ID_BASE) == last_id:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return self.events_since(username, last_id)
+
+    async def wait_async(self, username, last_id, timeout):
+        """wait() for asyncio handlers: parks the coroutine instead of a thread."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            pending = not self._stale(username, last_id) and self._last_id.get(username, EVENT_ID_BASE) == last_id
+            if pending:
+                self._async_waiters.setdefault(username, set()).add(waiter)
+        if pending:
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    self._async_waiters[username].discard(waiter)
+        return self.events_since(username, last_id)
+
+    def subscribe(self, username):
+        with self._cond:
+            self.subscribers[username] = self.subscribers.get(username, 0) + 1
+
+    def unsubscribe(self, username):
+        with self._cond:
+            self.subscribers[username] = max(0, self.subscribers.get(username, 0) - 1)
+
+
+def card_changes(old, new):
+    """Events describing how one card changed between two scrapes."""
+    if old is None:
+        return [('task_added', {'task': new})]
+    events = []
+    if old.get('Column') != new.get('Column'):
+        events.append(('task_moved', {'task': new, 'from': old.get('Column'), 'to': new.get('Column')}))
+    elif any(old.get(k) != new.get(k) for k in ('CaseNumber', 'Title', 'FBG', 'CardText')):
+        events.append(('task_updated', {'task': new}))
+    old_messages = old.get('messages') or []
+    new_messages = new.get('messages') or []
+    if new_messages != old_messages:
+        # Notes are append-only upstream; send only the tail unless history was rewritten
+        appended = new_messages[:len(old_messages)] == old_messages
+        events.append(('messages', {
+            'uuid': new.get('uuid'),
+            'CaseNumber': new.get('CaseNumber'),
+            'new_messages': new_messages[len(old_messages):] if appended else new_messages,
+            'replace': not appended,
+        }))
+    return events
+
+
+def format_sse(event_id, event_type, data_json):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data_json}\n\n"
+
+
+def heartbeat():
+    return f": heartbeat {int(time.time())}\n\n"
+
+
+hub = BoardEventHub()
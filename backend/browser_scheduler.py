@@ -0,0 +1,237 @@
+import os
+import time
+import asyncio
+import threading
+import itertools
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+# One scheduler for all browser work in the process: login scrapes, background
+# scrapes, technician assignment and token refresh each take a slot before
+# touching Chromium. Slots are granted by priority class, then to the user
+# served least recently, so interactive work never queues behind a background
+# cycle and one busy account cannot starve the others.
+
+INTERACTIVE = 0
+TOKEN = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", TOKEN: "token", BACKGROUND: "background"}
+# Preempted tickets resume ahead of every class so they release their session quickly
+_RESUME = -1
+
+# Memory one active browser job needs; the slot count is MemAvailable at
+# startup divided by this, capped at BROWSER_MAX_SLOTS. BROWSER_SLOTS forces it.
+BROWSER_SLOT_MB = int(os.environ.get("BROWSER_SLOT_MB", 400))
+BROWSER_MAX_SLOTS = int(os.environ.get("BROWSER_MAX_SLOTS", 6))
+
+
+def available_memory_mb():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_slots():
+    forced = os.environ.get("BROWSER_SLOTS")
+    if forced:
+        return max(1, int(forced))
+    memory = available_memory_mb()
+    if memory is None:
+        return 2
+    return max(1, min(BROWSER_MAX_SLOTS, memory // BROWSER_SLOT_MB))
+
+
+class Ticket:
+    _ids = itertools.count(1)
+
+    def __init__(self, kind, user, priority):
+        self.id = next(self._ids)
+        self.kind = kind
+        self.user = user
+        self.priority = priority
+        self.resume = False
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.granted = False
+        self.wake = None
+
+    def sort_key(self, last_grant):
+        return (_RESUME if self.resume else self.priority, last_grant.get(self.user, 0), self.id)
+
+
+# The ticket held by the current asyncio task, for checkpoint_async()
+current_ticket = contextvars.ContextVar("browser_ticket", default=None)
+
+
+class BrowserScheduler:
+    def __init__(self, slots=None):
+        self.slots = slots or default_slots()
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._running = {}
+        self._last_grant = {}
+        self._waits = {name: {"count": 0, "total": 0.0, "max": 0.0} for name in PRIORITY_NAMES.values()}
+        self.preemptions = 0
+        print(f"[Scheduler] {self.slots} browser slot(s).", flush=True)
+
+    # --- core, all under self._lock ---
+
+    def _pick(self):
+        return min(self._waiting, key=lambda t: t.sort_key(self._last_grant)) if self._waiting else None
+
+    def _dispatch(self):
+        while self._waiting and len(self._running) < self.slots:
+            ticket = self._pick()
+            self._waiting.remove(ticket)
+            self._running[ticket.id] = ticket
+            now = time.monotonic()
+            ticket.granted = True
+            ticket.granted_at = now
+            self._last_grant[ticket.user] = now
+            if not ticket.resume:
+                waits = self._waits[PRIORITY_NAMES[ticket.priority]]
+                waited = now - ticket.enqueued_at
+                waits["count"] += 1
+                waits["total"] += waited
+                waits["max"] = max(waits["max"], waited)
+            ticket.wake()
+
+    def _enqueue(self, ticket, wake):
+        ticket.granted = False
+        ticket.wake = wake
+        self._waiting.append(ticket)
+        self._dispatch()
+
+    def _abandon(self, ticket):
+        if ticket.granted:
+            self._running.pop(ticket.id, None)
+            self._dispatch()
+        elif ticket in self._waiting:
+            self._waiting.remove(ticket)
+
+    def _should_yield(self, ticket):
+        if ticket.priority <= INTERACTIVE or len(self._running) < self.slots:
+            return False
+        best = self._pick()
+        # Never yield to a waiter for the same user: it needs the session we hold
+        return bool(best and not best.resume and best.priority < ticket.priority and best.user != ticket.user)
+
+    # --- blocking API (Flask threads, assignment worker) ---
+
+    def acquire(self, kind, user, priority, timeout=None):
+        ticket = Ticket(kind, user, priority)
+        granted = threading.Event()
+        with self._lock:
+            self._enqueue(ticket, granted.set)
+        if not granted.wait(timeout):
+            with self._lock:
+                if not ticket.granted:
+                    self._waiting.remove(ticket)
+                    raise TimeoutError(f"No browser slot for {kind} within {timeout}s")
+        return ticket
+
+    def release(self, ticket):
+        with self._lock:
+            self._abandon(ticket)
+
+    @contextmanager
+    def slot(self, kind, user, priority, timeout=None):
+        ticket = self.acquire(kind, user, priority, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # --- asyncio API (scraper event loop) ---
+
+    async def _wait_async(self, ticket, register):
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        if not register(lambda: loop.call_soon_threadsafe(granted.set)):
+            return
+        try:
+            await granted.wait()
+        except asyncio.CancelledError:
+            with self._lock:
+                self._abandon(ticket)
+            raise
+
+    async def acquire_async(self, kind, user, priority):
+        ticket = Ticket(kind, user, priority)
+
+        def register(wake):
+            with self._lock:
+                self._enqueue(ticket, wake)
+            return True
+
+        await self._wait_async(ticket, register)
+        return ticket
+
+    @asynccontextmanager
+    async def slot_async(self, kind, user, priority):
+        ticket = await self.acquire_async(kind, user, priority)
+        token = current_ticket.set(ticket)
+        try:
+            yield ticket
+        finally:
+            current_ticket.reset(token)
+            self.release(ticket)
+
+    async def checkpoint_async(self):
+        """Safe point between browser steps: hand the slot to waiting higher-priority work."""
+        ticket = current_ticket.get()
+        if ticket is None:
+            return
+        await self._wait_async(ticket, lambda wake: self._preempt(ticket, wake))
+
+    def _preempt(self, ticket, wake):
+        """Release ticket's slot to a higher-priority waiter and queue it to resume first."""
+        with self._lock:
+            if not ticket.granted or not self._should_yield(ticket):
+                return False
+            self._running.pop(ticket.id, None)
+            self.preemptions += 1
+            # Grant the freed slot before re-queueing, or the resume key would win it back
+            self._dispatch()
+            ticket.resume = True
+            self._enqueue(ticket, wake)
+        print(f"[Scheduler] {ticket.kind} for {ticket.user} yielded its slot.", flush=True)
+        return True
+
+    # --- metrics ---
+
+    def metrics(self):
+        now = time.monotonic()
+        with self._lock:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for ticket in self._waiting:
+                depth[PRIORITY_NAMES[ticket.priority]] += 1
+            return {
+                "slots": self.slots,
+                "running": [
+                    {"kind": t.kind, "user": t.user, "priority": PRIORITY_NAMES[t.priority], "held": round(now - t.granted_at, 2)}
+                    for t in self._running.values()
+                ],
+                "queue_depth": depth,
+                "oldest_wait": round(max((now - t.enqueued_at for t in self._waiting), default=0), 2),
+                "wait_times": {
+                    name: {
+                        "count": w["count"],
+                        "avg": round(w["total"] / w["count"], 3) if w["count"] else 0,
+                        "max": round(w["max"], 3),
+                    }
+                    for name, w in self._waits.items()
+                },
+                "preemptions": self.preemptions,
+            }
+
+
+scheduler = BrowserScheduler()
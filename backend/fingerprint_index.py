@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import hashlib
+import re
+
+# Per-user index of card fingerprints so a scrape only re-reads notes for
+# cards that changed since the previous cycle.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.path.join(BASE_DIR, 'scraped_results', 'fingerprints')
+
+# Force a deep notes fetch for every card every N cycles or after this many
+# seconds, whichever comes first, in case a change left no trace on the card.
+FULL_REFRESH_EVERY = int(os.environ.get('SCRAPER_FULL_REFRESH_EVERY', 10))
+FULL_REFRESH_MAX_AGE = int(os.environ.get('SCRAPER_FULL_REFRESH_MAX_AGE', 3600))
+
+
+def card_fingerprint(column, card_text, note_hint=""):
+    raw = "\x1f".join([column or "", card_text or "", note_hint or ""])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class FingerprintIndex:
+    def __init__(self, username):
+        self.username = username
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', username)
+        self.path = os.path.join(INDEX_DIR, f'{safe}.json')
+        self.entries = {}
+        self.cycles_since_full = FULL_REFRESH_EVERY
+        self.last_full_at = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.cycles_since_full = data.get('cycles_since_full', FULL_REFRESH_EVERY)
+            self.last_full_at = data.get('last_full_at', 0)
+        except Exception as e:
+            print(f"[Fingerprint] Failed to load index for {self.username}, starting fresh: {e}", flush=True)
+            self.entries = {}
+
+    def needs_full_refresh(self):
+        return (
+            self.cycles_since_full >= FULL_REFRESH_EVERY
+            or time.time() - self.last_full_at > FULL_REFRESH_MAX_AGE
+        )
+
+    def cached_messages(self, uuid, fingerprint):
+        """Messages from the previous cycle if the card is unchanged, else None."""
+        entry = self.entries.get(uuid) if uuid else None
+        if entry and entry.get('fp') == fingerprint:
+            return entry.get('messages', [])
+        return None
+
+    def previous_messages(self, uuid):
+        """Last indexed messages for uuid whatever its fingerprint, [] when unknown."""
+        entry = self.entries.get(uuid) if uuid else None
+        return list(entry.get('messages', [])) if entry else []
+
+    def update(self, cards, full_refresh):
+        """Replace the index with this cycle's cards ({uuid, fp, messages}).
+
+        messages=None means the notes could not be read: the previous entry is
+        kept as it was (or the card left out), so the next cycle re-reads it.
+        """
+        now = int(time.time())
+        entries = {}
+        for card in cards:
+            if not card.get('uuid'):
+                continue
+            previous = self.entries.get(card['uuid'], {})
+            if card['messages'] is None:
+                if previous:
+                    entries[card['uuid']] = previous
+                continue
+            changed = previous.get('fp') != card['fp']
+            entries[card['uuid']] = {
+                'fp': card['fp'],
+                'messages': card['messages'],
+                'updated_at': now if changed else previous.get('updated_at', now),
+            }
+        self.entries = entries
+        if full_refresh:
+            self.cycles_since_full = 0
+            self.last_full_at = now
+        else:
+            self.cycles_since_full += 1
+
+    def save(self):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'entries': self.entries,
+                'cycles_since_full': self.cycles_since_full,
+                'last_full_at': self.last_full_at,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -1,28 +1,24 @@
-import subprocess
-import sys
 import json
 import time
 import threading
 import traceback
-from scraper import scrape
+import hmac
+from scraper import scrape, scrape_all, scraper_manager, SCRAPE_CONCURRENCY
+import task_store
+import board_events
+import readiness
+import resource_policy
+import assignment_worker
+from browser_scheduler import scheduler, INTERACTIVE
+from scrape_planner import ScrapePlanner
+from form_cache import form_cache
+from form_compiler import compiled_forms, validate as validate_form
+from template_store import template_store
+from token_manager import token_manager, TOKEN_REFRESH_TIMEOUT
 import os
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
-import asyncio
-
-playwright_lock = threading.Lock()
-
-# Event to pause/resume background scraper
-scraper_pause_event = threading.Event()
-scraper_pause_event.set()  # Initially not paused
-
-# Priority flag for add_technician
-add_technician_priority = threading.Event()
-add_technician_priority.clear()
-
-# Preemption flag: set when add_technician is requested, so scraper can pause ASAP
-add_technician_requested = threading.Event()
-add_technician_requested.clear()
+import queue
 
 USERS_FILE = os.path.join(os.path.dirname(__file__), 'users.json')
 
@@ -40,9 +36,24 @@ app = Flask(__name__, static_folder="static/dist", static_url_path="")
 CORS(app, supports_credentials=True)
 
 user_tasks = {}
+# Guards user_tasks, which scrape records update from the scraper pool's thread
+user_tasks_lock = threading.Lock()
+# username -> task keys seen by the scrape currently streaming records
+_streaming_runs = {}
+
+# Board versions for ETag / ?since= deltas. Versions start from a per-process
+# base so a cursor handed out before a restart is recognisably stale and gets
+# a full board instead of a delta with missing removals.
+VERSION_BASE = int(time.time() * 1000)
+MAX_TOMBSTONES = 1000
+board_versions = {}       # username -> current board version
+_task_versions = {}       # username -> {task key: {'version', 'messages_version'}}
+_tombstones = {}          # username -> {task key: {'version', 'uuid', 'CaseNumber', 'Column'}}
+_tombstone_floor = {}     # username -> versions at or below this may have lost tombstones
+_response_cache = {}      # (endpoint, username) -> (version, serialized body)
 background_scraping_started = False
-# Global asyncio lock to ensure only one Playwright instance runs at a time
-scrape_lock = asyncio.Lock()
+# Per-user scrape timing; a user with a dashboard on /events counts as active
+planner = ScrapePlanner(watchers=lambda username: board_events.hub.subscribers.get(username, 0))
 
 WORKERS_FILE = os.path.join(os.path.dirname(__file__), 'workers.json')
 
@@ -67,36 +78,230 @@ def save_workers(workers):
     with open(WORKERS_FILE, 'w') as f:
         json.dump(workers, f)
 
+def _live_columns(username):
+    """Board for username as last streamed by the scraper, seeded from the task store."""
+    columns = user_tasks.get(username)
+    if columns is None:
+        columns = task_store.get_columns(username)
+        user_tasks[username] = columns
+    return columns
+
+def _bump_version(username):
+    version = board_versions.get(username, VERSION_BASE) + 1
+    board_versions[username] = version
+    return version
+
+def _add_tombstone(username, key, task, version):
+    tombstones = _tombstones.setdefault(username, {})
+    tombstones[key] = {
+        'version': version, 'uuid': task.get('uuid'),
+        'CaseNumber': task.get('CaseNumber'), 'Column': task.get('Column'),
+    }
+    if len(tombstones) > MAX_TOMBSTONES:
+        oldest_key = min(tombstones, key=lambda k: tombstones[k]['version'])
+        _tombstone_floor[username] = tombstones.pop(oldest_key)['version']
+
+def apply_scrape_record(record):
+    """Apply one scraper record (run_started / card / run_finished) to user_tasks."""
+    username = record.get('username')
+    record_type = record.get('type')
+    if not username:
+        return
+    with user_tasks_lock:
+        columns = _live_columns(username)
+        if record_type == 'run_started':
+            _streaming_runs[username] = set()
+        elif record_type == 'card':
+            task = dict(record['card'])
+            col_key = task_store.COLUMN_KEYS.get(task.get('Column'))
+            if not col_key:
+                return
+            task['messages'] = task.get('messages') or []
+            task['has_new_message'] = len(task['messages']) > 0
+            key = task_store.task_key(task)
+            _streaming_runs.setdefault(username, set()).add(key)
+            # Replace in place when the card stays in its column, otherwise move it
+            old = None
+            for name, tasks in columns.items():
+                for i, existing in enumerate(tasks):
+                    if task_store.task_key(existing) == key:
+                        old = existing
+                        if name == col_key:
+                            tasks[i] = task
+                        else:
+                            del tasks[i]
+                        break
+                if old is not None:
+                    break
+            if old is None or old.get('Column') != task.get('Column'):
+                columns[col_key].append(task)
+            changes = board_events.card_changes(old, task)
+            if changes:
+                version = _bump_version(username)
+                versions = _task_versions.setdefault(username, {}).setdefault(
+                    key, {'version': VERSION_BASE, 'messages_version': VERSION_BASE})
+                if any(event_type != 'messages' for event_type, _ in changes):
+                    versions['version'] = version
+                if any(event_type == 'messages' for event_type, _ in changes):
+                    versions['messages_version'] = version
+                _tombstones.get(username, {}).pop(key, None)
+            for event_type, data in changes:
+                board_events.hub.publish(username, event_type, data)
+        elif record_type == 'run_finished':
+            seen = _streaming_runs.pop(username, None)
+            # Only a complete scrape can tell us which cards left the board
+            if record.get('status') == 'ok' and seen is not None:
+                for name in columns:
+                    kept = []
+                    for t in columns[name]:
+                        if task_store.task_key(t) in seen:
+                            kept.append(t)
+                        else:
+                            removed_key = task_store.task_key(t)
+                            _add_tombstone(username, removed_key, t, _bump_version(username))
+                            _task_versions.get(username, {}).pop(removed_key, None)
+                            board_events.hub.publish(username, 'task_removed', {
+                                'uuid': t.get('uuid'), 'CaseNumber': t.get('CaseNumber'), 'Column': t.get('Column'),
+                            })
+                    columns[name] = kept
+            board_events.hub.publish(username, 'scrape_finished', {
+                'status': record.get('status'), 'cards': record.get('cards', 0),
+            })
+
+def snapshot_columns(username):
+    with user_tasks_lock:
+        return {name: list(tasks) for name, tasks in _live_columns(username).items()}
+
+def board_delta(username, since, field):
+    """(version, columns, removed) with tasks whose `field` version is newer than since.
+
+    columns/removed are None when since is too old to build a delta from.
+    """
+    with user_tasks_lock:
+        columns = _live_columns(username)
+        version = board_versions.get(username, VERSION_BASE)
+        if since is None or since < VERSION_BASE or since < _tombstone_floor.get(username, 0) or since > version:
+            return version, None, None
+        versions = _task_versions.get(username, {})
+        changed = {
+            name: [t for t in tasks if versions.get(task_store.task_key(t), {}).get(field, VERSION_BASE) > since]
+            for name, tasks in columns.items()
+        }
+        removed = [
+            {'uuid': t['uuid'], 'CaseNumber': t['CaseNumber'], 'Column': t['Column']}
+            for t in _tombstones.get(username, {}).values() if t['version'] > since
+        ]
+        return version, changed, removed
+
+def versioned_payload(endpoint, username, build, since, etag_matches):
+    """(etag, version, body) for a versioned endpoint; body is None when etag_matches(etag).
+
+    since=<version> returns only what changed after that version; the full
+    body for a version is serialized once and reused until the board changes.
+    """
+    planner.note_activity(username)
+    version = board_versions.get(username, VERSION_BASE)
+    etag = f"{endpoint}-{username}-{version}"
+    if etag_matches(etag):
+        return etag, version, None
+    body = None
+    if since is not None:
+        body = build(username, since)
+    if body is None:
+        cached = _response_cache.get((endpoint, username))
+        if cached and cached[0] == version:
+            body = cached[1]
+        else:
+            body = json.dumps(build(username, None), ensure_ascii=False)
+            _response_cache[(endpoint, username)] = (version, body)
+    elif not isinstance(body, str):
+        body = json.dumps(body, ensure_ascii=False)
+    return etag, version, body
+
+def versioned_response(endpoint, username, build):
+    """JSON response tagged with the board version; 304 when If-None-Match matches."""
+    etag, version, body = versioned_payload(
+        endpoint, username, build, request.args.get('since', type=int), request.if_none_match.contains)
+    resp = Response(status=304) if body is None else Response(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Board-Version'] = str(version)
+    return resp
+
+def _build_tasks_response(username, since):
+    if since is None:
+        return {'columns': snapshot_columns(username), 'version': board_versions.get(username, VERSION_BASE), 'full': True}
+    version, changed, removed = board_delta(username, since, 'version')
+    if changed is None:
+        return None
+    return {'columns': changed, 'removed': removed, 'version': version, 'full': False}
+
+def _build_messages_response(username, since):
+    if since is None:
+        columns = snapshot_columns(username)
+        tasks = [task for col_tasks in columns.values() for task in col_tasks]
+        return {'messages': task_store.summarize_messages(tasks), 'version': board_versions.get(username, VERSION_BASE), 'full': True}
+    version, changed, removed = board_delta(username, since, 'messages_version')
+    if changed is None:
+        return None
+    tasks = [task for col_tasks in changed.values() for task in col_tasks]
+    return {'messages': task_store.summarize_messages(tasks), 'removed': removed, 'version': version, 'full': False}
+
+# Server-Sent Events stream of board changes for one user. The first event is
+# a full snapshot; afterwards only task_added/moved/updated/removed, messages
+# and scrape_finished events are pushed. Reconnects resume from Last-Event-ID.
+@app.route('/events', methods=['GET'])
+def board_event_stream():
+    username = request.args.get('username')
+    if not username:
+        return jsonify({'error': 'Username required'}), 400
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    def snapshot_event():
+        with user_tasks_lock:
+            event_id = board_events.hub.last_id(username)
+            columns = {name: list(tasks) for name, tasks in _live_columns(username).items()}
+        return event_id, board_events.format_sse(event_id, 'snapshot', json.dumps({'columns': columns}))
+
+    def stream():
+        cursor = last_event_id
+        board_events.hub.subscribe(username)
+        planner.wake()
+        try:
+            if cursor is None or board_events.hub.events_since(username, cursor) is None:
+                cursor, payload = snapshot_event()
+                yield payload
+            while True:
+                events = board_events.hub.wait(username, cursor, board_events.HEARTBEAT_INTERVAL)
+                if events is None:
+                    # Client fell too far behind the history buffer; resync with a snapshot
+                    cursor, payload = snapshot_event()
+                    yield payload
+                    continue
+                if not events:
+                    yield board_events.heartbeat()
+                    continue
+                for event_id, event_type, data in events:
+                    yield board_events.format_sse(event_id, event_type, json.dumps(data))
+                    cursor = event_id
+        finally:
+            board_events.hub.unsubscribe(username)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.route('/check_new_tasks', methods=['GET'])
 def check_new_tasks():
     username = request.args.get('username')
     if not username:
         return jsonify({'error': 'Username required'}), 400
-    columns = user_tasks.get(username)
-    if not columns:
-        return jsonify({'columns': {'NEW': [], 'Pending': [], 'In Progress': []}})
-    # Attach messages from latest CSV to each task
-    import csv, glob
-    csv_files = glob.glob(os.path.join(os.path.dirname(__file__), 'scraped_results', 'scraped_*.csv'))
-    uuid_to_messages = {}
-    if csv_files:
-        latest_csv = max(csv_files, key=os.path.getmtime)
-        with open(latest_csv, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                uuid = row.get('uuid')
-                messages_json = row.get('messages')
-                if uuid and messages_json:
-                    try:
-                        messages = json.loads(messages_json.replace('""', '"'))
-                    except Exception:
-                        messages = []
-                    uuid_to_messages[uuid] = messages
-    for col_tasks in columns.values():
-        for task in col_tasks:
-            task['messages'] = uuid_to_messages.get(task.get('uuid'), [])
-            task['has_new_message'] = len(task['messages']) > 0
-    return jsonify({'columns': columns})
+    return versioned_response('tasks', username, _build_tasks_response)
 
 # Endpoint to assign a technician to a task on the real website
 @app.route('/add_technician', methods=['POST'])
@@ -112,26 +317,7 @@ def add_technician():
         missing.append('worker_name')
     if missing:
         return jsonify({'error': f"Missing required field(s): {', '.join(missing)}", 'received': data}), 400
-    # Use hardcoded username/password from users.json
-    username = "e_morahas"
-    password = "4RW,Xlo22*50"
-    try:
-        print("[add_technician] Launching add_technician.py in a new browser instance", flush=True)
-        # No lock, no pause, just launch a new process
-        result = subprocess.run([
-            sys.executable, 'add_technician.py',
-            task_uuid, worker_name, username, password
-        ], capture_output=True, text=True, cwd=os.path.dirname(__file__), timeout=180)
-        output = result.stdout + '\n' + result.stderr
-        print(f"[DEBUG] add_technician.py output:\n{output}")
-        print(f"[DEBUG] add_technician.py returncode: {result.returncode}")
-        if result.returncode == 0:
-            return jsonify({'success': True, 'output': output})
-        else:
-            return jsonify({'success': False, 'output': output}), 500
-    except Exception as e:
-        print(f"[ERROR] Exception in /add_technician: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+    return queue_assignment_job([(task_uuid, worker_name)], data.get('username'))
 
 
 # Endpoint to get all technicians (persistent)
@@ -140,189 +326,257 @@ def get_workers():
     workers = load_workers()
     return jsonify(workers)
 
+# Wait timings from the readiness layer for in-process browser flows
+@app.route('/api/readiness', methods=['GET'])
+def get_readiness_stats():
+    return jsonify(readiness.stats())
+
+# Assign many (task, worker) pairs in one browser session; workers sharing a
+# task are saved together. Body: {"assignments": [{"task_uuid", "worker_name" | "worker_names"}]}
+@app.route('/api/add_technicians', methods=['POST'])
+def add_technicians_batch():
+    data = request.json or {}
+    assignments = []
+    for i, item in enumerate(data.get('assignments') or []):
+        task_uuid = item.get('task_uuid') if isinstance(item, dict) else None
+        names = (item.get('worker_names') or [item.get('worker_name')]) if task_uuid else []
+        names = [n for n in names if n]
+        if not task_uuid or not names:
+            return jsonify({'error': f"Assignment {i} needs task_uuid and worker_name or worker_names", 'received': item}), 400
+        assignments.extend((task_uuid, name) for name in names)
+    if not assignments:
+        return jsonify({'error': 'Missing required field: assignments'}), 400
+    return queue_assignment_job(assignments, data.get('username'))
+
+def submit_assignment_job(assignments, notify_username=None):
+    """Queue assignments on the worker; (body, status) with 202 and the job id to poll.
+
+    When notify_username is given, job status changes are also pushed to that
+    dashboard's /events stream as assignment_job events.
+    """
+    # Use hardcoded username/password from users.json
+    username = "e_morahas"
+    password = "4RW,Xlo22*50"
+    on_update = None
+    if notify_username:
+        on_update = lambda job: board_events.hub.publish(notify_username, 'assignment_job', job)
+    try:
+        job = assignment_worker.get_worker(username, password).submit_batch(assignments, on_update)
+    except queue.Full:
+        return {'success': False, 'error': 'Too many assignments queued, try again shortly'}, 429
+    body = job.to_dict()
+    body['status_url'] = f"/api/jobs/{job.id}"
+    return body, 202
+
+def queue_assignment_job(assignments, notify_username=None):
+    body, status = submit_assignment_job(assignments, notify_username)
+    return jsonify(body), status
+
+# Assignment job status; DELETE cancels a queued job or stops a running one before its next task
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def assignment_job_status(job_id):
+    job = assignment_worker.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    if request.method == 'DELETE':
+        if not job.cancel():
+            return jsonify({'error': f"Job already {job.status}", 'job': job.to_dict()}), 409
+    return jsonify(job.to_dict())
+
+# Per-user scrape plan: engagement, interval, next run, backoff and hourly budget
+@app.route('/api/scrape-plan', methods=['GET'])
+def get_scrape_plan():
+    return jsonify(planner.snapshot([u['username'] for u in load_users()]))
+
+# Browser scheduler slots, queue depth and wait times per priority class
+@app.route('/api/scheduler', methods=['GET'])
+def get_scheduler_metrics():
+    return jsonify(scheduler.metrics())
+
+# Assignment worker state per account
+@app.route('/api/assignment-workers', methods=['GET'])
+def get_assignment_workers():
+    return jsonify(assignment_worker.stats())
+
+# Blocked vs allowed request counters per browser flow
+@app.route('/api/resource-stats', methods=['GET'])
+def get_resource_stats():
+    return jsonify(resource_policy.stats())
+
 def start_background_scraping():
     def background_scraper():
-        import csv, glob
-        print("[Background] Scraper subprocess loop started.")
+        print("[Background] Scraper loop started.")
         while True:
-            scraper_pause_event.wait()
-            if add_technician_priority.is_set():
-                print("[Background] add_technician is waiting, skipping this scraper cycle.")
-                time.sleep(2)
-                continue
-            print("[Background] Waiting for lock...", flush=True)
-            print("[Background] Scraper run started ---")
+            usernames = []
             try:
-                users = load_users()
-                for user in users:
-                    # Preemption: pause ASAP if add_technician_requested is set
-                    if add_technician_requested.is_set():
-                        print("[Background] Preemption requested, pausing scraper for add_technician.")
-                        break
-                    username = user['username']
-                    password = user['password']
-                    print(f"[Background] Scraping for user: {username}")
-                    try:
-                        with playwright_lock:
-                            # Check preemption again right before starting Playwright
-                            if add_technician_requested.is_set():
-                                print("[Background] Preemption requested before Playwright session, skipping user.")
-                                break
-                            print("[Background] Acquired lock, running scraper.py", flush=True)
-                            process = subprocess.Popen([
-                                sys.executable, 'scraper.py', username, password
-                            ], cwd=os.path.dirname(__file__), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-                            print(f"[Background] scraper.py output for {username}:")
-                            for line in process.stdout:
-                                print(line, end='')
-                            process.wait()
-                        print("[Background] Released lock", flush=True)
-                        if process.returncode != 0:
-                            print(f"[Background] scraper.py failed for {username} with code {process.returncode}")
-                    except Exception as e:
-                        print(f"[Background] Exception running scraper.py for {username}: {e}")
-                        print("[Background] Delaying 5s after error to allow add_technician to run.", flush=True)
-                        time.sleep(5)
-                # If preemption was requested, give add_technician a chance to run
-                if add_technician_requested.is_set():
-                    print("[Background] Preemption: waiting 2s for add_technician to acquire lock...")
-                    time.sleep(2)
+                users = {u['username']: u for u in load_users()}
+                usernames = list(users)
+                # A login refresh already in flight covers its user this round
+                due = planner.due([u for u in usernames if u not in _login_refreshes])
+                if due:
+                    print(f"[Background] Scraping {len(due)}/{len(users)} due user(s), concurrency {SCRAPE_CONCURRENCY}", flush=True)
+                    versions_before = {u: board_versions.get(u) for u in due}
+                    # Each user's scrape takes a background slot from the browser
+                    # scheduler; logins and assignments are granted slots first
+                    results = scraper_manager.run(scrape_all(
+                        [users[u] for u in due],
+                        concurrency=SCRAPE_CONCURRENCY,
+                        on_record=apply_scrape_record,
+                    ))
+                    for u, r in results.items():
+                        planner.record(u, r.get('status'), board_versions.get(u) != versions_before.get(u))
+                    failed = [u for u, r in results.items() if r.get('status') not in ('ok', 'skipped')]
+                    if failed:
+                        print(f"[Background] Scrape failed for: {', '.join(failed)}", flush=True)
             except Exception as e:
                 print(f"[Background] Error during scraping: {e}")
                 print(traceback.format_exc())
-                print("[Background] Delaying 5s after error to allow add_technician to run.", flush=True)
                 time.sleep(5)
-            print("[Background] Scraper run finished --- Waiting 120s\n")
-            print("[Background] About to sleep for 120s...")
-            time.sleep(120)
-            print("[Background] Woke up from 120s sleep, will start next run...")
+            # Sleep until the next user is due; a dashboard connecting wakes us early
+            planner.wait(min(60, max(1, planner.seconds_until_next(usernames))))
     t = threading.Thread(target=background_scraper, daemon=True)
     t.start()
-    print(f"[Main] Background scraper subprocess thread started. Thread ident: {t.ident}, is_alive: {t.is_alive()}")
+    print(f"[Main] Background scraper thread started. Thread ident: {t.ident}, is_alive: {t.is_alive()}")
 
 @app.route('/check_task_messages', methods=['GET'])
 def check_task_messages():
-    import csv
-    import glob
     username = request.args.get('username')
     if not username:
         return jsonify({'error': 'Username required'}), 400
-    columns = user_tasks.get(username)
-    if not columns:
-        return jsonify({'messages': {}})
-    # Find the latest CSV file in scraped_results
-    csv_files = glob.glob(os.path.join(os.path.dirname(__file__), 'scraped_results', 'scraped_*.csv'))
-    if not csv_files:
-        return jsonify({'messages': {}})
-    latest_csv = max(csv_files, key=os.path.getmtime)
-    # Build a mapping from uuid to messages
-    uuid_to_messages = {}
-    with open(latest_csv, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            uuid = row.get('uuid')
-            messages_json = row.get('messages')
-            if uuid and messages_json:
-                try:
-                    messages = json.loads(messages_json.replace('""', '"'))
-                except Exception:
-                    messages = []
-                uuid_to_messages[uuid] = messages
-    result = {}
-    for col_tasks in columns.values():
-        for task in col_tasks:
-            case_number = task.get('CaseNumber')
-            task_uuid = task.get('uuid')
-            messages = uuid_to_messages.get(task_uuid, [])
-            last_message = messages[-1]['message'] if messages else None
-            last_message_date = messages[-1]['date'] if messages else None
-            result[case_number] = {
-                'messages': messages,
-                'uuid': task_uuid,
-                'last_message': last_message,
-                'last_message_date': last_message_date
-            }
-    return jsonify({'messages': result})
+    return versioned_response('messages', username, _build_messages_response)
+
+# /login answers from a snapshot up to this old and refreshes it in the
+# background; snapshots younger than LOGIN_REFRESH_MIN_AGE are not refreshed.
+LOGIN_SNAPSHOT_MAX_AGE = int(os.environ.get('LOGIN_SNAPSHOT_MAX_AGE', 6 * 3600))
+LOGIN_REFRESH_MIN_AGE = int(os.environ.get('LOGIN_REFRESH_MIN_AGE', 60))
+_login_refreshes = {}  # username -> Future of the background login scrape
+_login_refreshes_lock = threading.Lock()
+
+def credentials_known(username, password):
+    """True when username/password match users.json, i.e. SSO accepted them before."""
+    user = next((u for u in load_users() if u['username'] == username), None)
+    return user is not None and hmac.compare_digest(str(user.get('password', '')), str(password))
+
+def register_user(username, password):
+    # Add user to users.json if not present, or store a newly verified password
+    users = load_users()
+    user = next((u for u in users if u['username'] == username), None)
+    if user is None:
+        users.append({'username': username, 'password': password})
+        save_users(users)
+        print(f"[Login] Added new user to users.json: {username}")
+    elif user.get('password') != password:
+        user['password'] = password
+        save_users(users)
+        print(f"[Login] Updated password in users.json: {username}")
+
+async def login_scrape(username, password):
+    # Scrape this user on the shared browser pool ahead of background work
+    async with scheduler.slot_async("login_scrape", username, INTERACTIVE):
+        return await scrape(username, password, on_record=apply_scrape_record)
+
+def record_login_scrape(username, version_before):
+    result = scraper_manager.last_results.get(username, {})
+    planner.note_activity(username)
+    planner.record(username, result.get('status', 'failed'), board_versions.get(username) != version_before)
+
+def finish_login(username):
+    """The user's columns; starts the background loop on first login."""
+    global background_scraping_started
+    # user_tasks was filled card by card while the scrape streamed its records
+    columns = snapshot_columns(username)
+    print(f"[Login] Tasks for {username}: {json.dumps(columns)[:500]} ...")
+    # Start background scraping only after first login
+    if not background_scraping_started:
+        print("Starting background scraping thread after first login...")
+        start_background_scraping()
+        background_scraping_started = True
+    return {
+        'NEW': columns['NEW'],
+        'Pending': columns['Pending'],
+        'In Progress': columns['In Progress']
+    }
+
+def snapshot_age(username):
+    """Seconds since username's board was last scraped successfully, or None."""
+    finished = []
+    result = scraper_manager.last_results.get(username)
+    if result and result.get('status') == 'ok':
+        finished.append(result['finished_at'])
+    run = task_store.latest_run(username)
+    if run and run['status'] == 'ok':
+        finished.append(run['finished_at'])
+    return time.time() - max(finished) if finished else None
+
+def schedule_login_refresh(username, password):
+    """Start a login-priority scrape without waiting; one per user at a time.
+
+    Its cards reach the dashboard through /events and the versioned polling
+    endpoints like any other scrape.
+    """
+    with _login_refreshes_lock:
+        if username in _login_refreshes:
+            return
+        version_before = board_versions.get(username)
+        future = _login_refreshes[username] = scraper_manager.submit(login_scrape(username, password))
+
+    def done(f):
+        with _login_refreshes_lock:
+            _login_refreshes.pop(username, None)
+        if f.exception():
+            print(f"[Login] Background refresh for {username} failed: {f.exception()}", flush=True)
+        record_login_scrape(username, version_before)
+
+    future.add_done_callback(done)
+
+def login_from_snapshot(username, password):
+    """Login body from username's last snapshot, refreshed in the background; None without one."""
+    age = snapshot_age(username)
+    if age is None or age > LOGIN_SNAPSHOT_MAX_AGE:
+        return None
+    refreshing = age > LOGIN_REFRESH_MIN_AGE
+    if refreshing:
+        schedule_login_refresh(username, password)
+    print(f"[Login] Answering {username} from a {int(age)}s old snapshot (refreshing: {refreshing}).")
+    return {'success': True, 'columns': finish_login(username), 'snapshot_age': round(age), 'refreshing': refreshing}
 
 @app.route('/login', methods=['POST'])
 def login():
-    global background_scraping_started
     try:
-        data = request.json
+        data = request.json or {}
         username = data.get('username')
         password = data.get('password')
-        # Add user to users.json if not present
-        users = load_users()
-        if not any(u['username'] == username for u in users):
-            users.append({'username': username, 'password': password})
-            save_users(users)
-            print(f"[Login] Added new user to users.json: {username}")
-        # Run scraping for this user and store results
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        async def locked_scrape():
-            async with scrape_lock:
-                return await scrape(username, password)
-        scraped_data = loop.run_until_complete(locked_scrape())
-        columns = {
-            'NEW': [],
-            'Pending': [],
-            'In Progress': []
-        }
-        # Load messages from latest CSV and merge into tasks by uuid
-        import csv, glob
-        csv_files = glob.glob(os.path.join(os.path.dirname(__file__), 'scraped_results', 'scraped_*.csv'))
-        uuid_to_messages = {}
-        if csv_files:
-            latest_csv = max(csv_files, key=os.path.getmtime)
-            with open(latest_csv, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    uuid = row.get('uuid')
-                    messages_json = row.get('messages')
-                    if uuid and messages_json:
-                        try:
-                            messages = json.loads(messages_json.replace('""', '"'))
-                        except Exception:
-                            messages = []
-                        uuid_to_messages[uuid] = messages
-        for task in scraped_data:
-            col = task.get('Column')
-            # Ensure uuid is present for every task
-            if 'uuid' not in task or not task['uuid']:
-                task['uuid'] = None
-            # Attach messages from CSV if available
-            task['messages'] = uuid_to_messages.get(task['uuid'], [])
-            if col == 'New':
-                task['has_new_message'] = len(task['messages']) > 0
-                columns['NEW'].append(task)
-            elif col == 'Pending':
-                task['has_new_message'] = len(task['messages']) > 0
-                columns['Pending'].append(task)
-            elif col == 'In Progress':
-                task['has_new_message'] = len(task['messages']) > 0
-                columns['In Progress'].append(task)
-        user_tasks[username] = columns
-        print(f"[Login] Updated tasks for {username}: {json.dumps(columns)[:500]} ...")
-        # Start background scraping only after first login
-        if not background_scraping_started:
-            print("Starting background scraping thread after first login...")
-            start_background_scraping()
-            background_scraping_started = True
-        return jsonify({
-            'success': True,
-            'columns': {
-                'NEW': columns['NEW'],
-                'Pending': columns['Pending'],
-                'In Progress': columns['In Progress']
-            }
-        })
+        if not username or not password:
+            return jsonify({'success': False, 'error': 'Username and password required'}), 400
+        # Known credentials skip SSO; new or changed ones get a login without a scrape
+        if not credentials_known(username, password):
+            if not scraper_manager.run(scraper_manager.verify_login(username, password)):
+                return jsonify({'success': False, 'error': 'Invalid username or password'}), 401
+            register_user(username, password)
+        body = login_from_snapshot(username, password)
+        if body is None:
+            version_before = board_versions.get(username)
+            scraper_manager.run(login_scrape(username, password))
+            record_login_scrape(username, version_before)
+            body = {'success': True, 'columns': finish_login(username), 'snapshot_age': 0, 'refreshing': False}
+        return jsonify(body)
     except Exception as e:
         print(f"[ERROR] Exception in /login: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 # In-memory upload status store
 UPLOAD_STATUS = {}
-# Endpoint to save form template JSON
+def template_page(offset, limit, prefix=None):
+    """Saved template files for the list endpoints; a page when limit is set."""
+    names, total = template_store.list(offset, limit, prefix)
+    next_offset = offset + len(names)
+    return {
+        'files': [f"{name}.json" for name in names],
+        'total': total,
+        'offset': offset,
+        'next_offset': next_offset if next_offset < total else None,
+    }
+
+# Endpoint to save form template JSON; identical forms are stored once
 @app.route('/api/save-form-template', methods=['POST'])
 def save_form_template():
     data = request.get_json()
@@ -330,51 +584,107 @@ def save_form_template():
     form_data = data.get('formData')
     if not task_id or not form_data:
         return jsonify({'error': 'Missing taskId or formData'}), 400
-    save_dir = os.path.join(os.path.dirname(__file__), 'form-templates')
-    os.makedirs(save_dir, exist_ok=True)
-    save_path = os.path.join(save_dir, f'{task_id}.json')
     try:
-        with open(save_path, 'w', encoding='utf-8') as f:
-            json.dump(form_data, f, ensure_ascii=False, indent=2)
-        return jsonify({'success': True, 'path': save_path})
+        saved = template_store.save(task_id, form_data)
+        return jsonify({'success': True, **saved})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 import requests
 
-TOKEN_FILE = os.path.join(os.path.dirname(__file__), 'token.json')
-
-def load_token():
-    if not os.path.exists(TOKEN_FILE):
+def refresh_user_token(username):
+    # Lightweight refresh for token_manager: board reload in the pooled context
+    user = next((u for u in load_users() if u['username'] == username), None)
+    if not user:
         return None
-    with open(TOKEN_FILE, 'r') as f:
-        data = json.load(f)
-        return data.get('token')
+    return scraper_manager.run(scraper_manager.refresh_token(username, user['password']), timeout=TOKEN_REFRESH_TIMEOUT)
 
+token_manager.set_refresher(refresh_user_token)
 
-# Endpoint to fetch dynamic form JSON for a task
-@app.route('/api/form/<task_id>', methods=['GET'])
-def get_task_form(task_id):
-    token = load_token()
+
+def load_task_form(task_id, username=None):
+    """(body, status, cache_state) for /api/form; blocks on upstream and token refresh."""
+    token = token_manager.get(username)
     if not token:
-        return jsonify({'error': 'Token not found'}), 401
-    api_url = f"https://fmsapi.el.earthlink.iq/api/tasks/tasks/{task_id}/template-form"
-    headers = {"Authorization": f"Bearer {token}"}
+        return {'error': 'Token not found'}, 401, None
     try:
-        resp = requests.get(api_url, headers=headers, timeout=15)
-        resp.raise_for_status()
-        data = resp.json()
-        # Save the JSON response to api-form.json in the backend directory
-        save_path = os.path.join(os.path.dirname(__file__), 'api-form.json')
-        with open(save_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return jsonify(data)
+        try:
+            data, cache_state = form_cache.get(task_id, token)
+        except requests.HTTPError as e:
+            if getattr(e.response, 'status_code', None) != 401:
+                raise
+            # Upstream rejected the token before its exp; refresh once and retry
+            print(f"[Token] 401 for task {task_id}, refreshing token...", flush=True)
+            token_manager.invalidate(username)
+            token = token_manager.get(username)
+            if not token:
+                return {'error': 'Token expired and could not be refreshed'}, 401, None
+            data, cache_state = form_cache.get(task_id, token)
     except requests.RequestException as e:
-        print(f"[ERROR] Failed to fetch form from {api_url}")
+        print(f"[ERROR] Failed to fetch form for task {task_id}")
         print(f"[ERROR] Status code: {getattr(e.response, 'status_code', None)}")
         print(f"[ERROR] Response text: {getattr(e.response, 'text', None)}")
         print(f"[ERROR] Exception: {e}")
-        return jsonify({'error': str(e), 'status_code': getattr(e.response, 'status_code', None), 'details': getattr(e.response, 'text', None)}), 502
+        return {'error': str(e), 'status_code': getattr(e.response, 'status_code', None), 'details': getattr(e.response, 'text', None)}, 502, None
+    if cache_state == 'miss':
+        # Keep the latest upstream form in api-form.json for form-api-reader.py
+        save_path = os.path.join(os.path.dirname(__file__), 'api-form.json')
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    return data, 200, cache_state
+
+# Endpoint to fetch dynamic form JSON for a task
+@app.route('/api/form/<task_id>', methods=['GET'])
+def get_task_form(task_id):
+    body, status, cache_state = load_task_form(task_id, request.args.get('username') or None)
+    response = jsonify(body)
+    response.status_code = status
+    if cache_state:
+        response.headers['X-Form-Cache'] = cache_state
+    return response
+
+def compiled_task_form(task_id, username=None):
+    """(body, status, cache_state) with the task's compiled template and its formData."""
+    data, status, cache_state = load_task_form(task_id, username)
+    if status != 200:
+        return data, status, cache_state
+    body = dict(compiled_forms.for_form(data), formData=data.get('formData'))
+    return body, status, cache_state
+
+def validate_task_form(task_id, form_data, username=None):
+    """(body, status) listing form_data's errors against the task's compiled template."""
+    data, status, _ = load_task_form(task_id, username)
+    if status != 200:
+        return data, status
+    errors = validate_form(compiled_forms.for_form(data), form_data)
+    return {'valid': not errors, 'errors': errors}, 200
+
+# Task form with its template compiled: pruned components plus a flat field index
+@app.route('/api/form/<task_id>/compiled', methods=['GET'])
+def get_compiled_task_form(task_id):
+    body, status, cache_state = compiled_task_form(task_id, request.args.get('username') or None)
+    response = jsonify(body)
+    response.status_code = status
+    if cache_state:
+        response.headers['X-Form-Cache'] = cache_state
+    return response
+
+# Check formData against the task's compiled template: required fields and choice values
+@app.route('/api/form/<task_id>/validate', methods=['POST'])
+def post_validate_task_form(task_id):
+    data = request.get_json() or {}
+    body, status = validate_task_form(task_id, data.get('formData'), data.get('username') or request.args.get('username') or None)
+    return jsonify(body), status
+
+# Per-user API token expiry and refresh counters
+@app.route('/api/tokens', methods=['GET'])
+def get_token_stats():
+    return jsonify(token_manager.stats())
+
+# Template form cache counters and sizes
+@app.route('/api/form-cache', methods=['GET'])
+def get_form_cache_stats():
+    return jsonify(dict(form_cache.stats(), compiled=compiled_forms.stats()))
 
 # --- CATCH-ALL ROUTE FOR REACT SPA ---
 @app.route('/', defaults={'path': ''})
@@ -386,27 +696,37 @@ def serve_react(path):
     # Otherwise, serve index.html for React Router
     return send_from_directory(app.static_folder, 'index.html')
 
-# Endpoint to list all saved form templates
+# Endpoint to list saved form templates, paged: ?offset=&limit=&prefix=
 @app.route('/api/list-form-templates', methods=['GET'])
 def list_form_templates():
-    templates_dir = os.path.join(os.path.dirname(__file__), 'form-templates')
-    files = []
-    if os.path.exists(templates_dir):
-        files = [f for f in os.listdir(templates_dir) if f.endswith('.json')]
-    return jsonify({'files': files})
+    offset = request.args.get('offset', 0, type=int)
+    # Without a limit the full list is returned, as the dashboard expects
+    limit = request.args.get('limit', type=int)
+    return jsonify(template_page(offset, limit, request.args.get('prefix')))
 
-# Endpoint to serve a form template by filename
+# Endpoint to serve a saved form template by filename; the content hash is its ETag
 @app.route('/api/form-template/<filename>', methods=['GET'])
 def get_form_template(filename):
-    import os
-    from flask import abort
-    templates_dir = os.path.join(os.path.dirname(__file__), 'form-templates')
-    file_path = os.path.join(templates_dir, filename)
-    if not os.path.exists(file_path) or not filename.endswith('.json'):
-        return abort(404)
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return jsonify(data)
+    if not filename.endswith('.json'):
+        return jsonify({'error': 'Not found'}), 404
+    name = filename[:-len('.json')]
+    etag = template_store.etag(name)
+    if etag and request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        found = template_store.get(name)
+        if found is None:
+            return jsonify({'error': 'Not found'}), 404
+        body, etag = found
+        resp = Response(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+# Saved template store: names, distinct forms and read cache counters
+@app.route('/api/template-store', methods=['GET'])
+def get_template_store_stats():
+    return jsonify(template_store.stats())
 
     
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# Thin client for the FMS REST API (fmsapi.el.earthlink.iq) sharing one
+# keep-alive connection pool across every caller in the process.
+
+FMS_API_BASE = "https://fmsapi.el.earthlink.iq/api"
+NOTES_URL_TEMPLATE = os.environ.get("FMS_NOTES_URL", FMS_API_BASE + "/tasks/tasks/{uuid}/notes")
+TEMPLATE_FORM_URL_TEMPLATE = FMS_API_BASE + "/tasks/tasks/{task_id}/template-form"
+FMS_API_TIMEOUT = int(os.environ.get("FMS_API_TIMEOUT", 15))
+NOTES_FETCH_CONCURRENCY = int(os.environ.get("NOTES_FETCH_CONCURRENCY", 8))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared requests.Session with a connection pool sized for bulk note fetches."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, NOTES_FETCH_CONCURRENCY * 2))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept": "application/json"})
+            _session = session
+        return _session
+
+
+def auth_headers(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _first(data, *keys):
+    for key in keys:
+        value = data.get(key)
+        if value:
+            return value
+    return ""
+
+
+def normalize_note(note):
+    """Map an API note onto the {sender, message, date} shape the scraper stores."""
+    if not isinstance(note, dict):
+        return {"sender": "", "message": str(note), "date": ""}
+    sender = _first(note, "sender", "createdBy", "userName", "user", "author")
+    if isinstance(sender, dict):
+        sender = _first(sender, "fullName", "name", "userName", "username")
+    return {
+        "sender": sender or "",
+        "message": str(_first(note, "message", "note", "text", "content", "body")).strip(),
+        "date": _first(note, "date", "createdAt", "creationDate", "createdDate", "created"),
+    }
+
+
+def fetch_task_notes(uuid, token):
+    resp = get_session().get(NOTES_URL_TEMPLATE.format(uuid=uuid), headers=auth_headers(token), timeout=FMS_API_TIMEOUT)
+    resp.raise_for_status()
+    data = resp.json()
+    if isinstance(data, dict):
+        # Only an explicit list under a known key counts; anything else is a failure
+        data = next((data[k] for k in ("data", "items", "notes") if isinstance(data.get(k), list)), None)
+    if not isinstance(data, list):
+        raise ValueError(f"Unrecognized notes response for {uuid}")
+    return [normalize_note(n) for n in data]
+
+
+def fetch_notes_bulk(uuids, token, max_workers=NOTES_FETCH_CONCURRENCY):
+    """Fetch notes for many tasks in parallel.
+
+    Returns {uuid: messages}; a uuid maps to None when its request failed so the
+    caller can fall back to another source for just that task.
+    """
+    results = {}
+    uuids = [u for u in dict.fromkeys(uuids) if u]
+    if not uuids or not token:
+        return results
+
+    def fetch(uuid):
+        try:
+            return uuid, fetch_task_notes(uuid, token)
+        except Exception as e:
+            print(f"[FMS API] Failed to fetch notes for {uuid}: {e}", flush=True)
+            return uuid, None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for uuid, messages in executor.map(fetch, uuids):
+            results[uuid] = messages
+    return results
+
+
+def fetch_task_form(task_id, token):
+    """Template form for a task: {templateId, templateName, formTemplate, formData}."""
+    resp = get_session().get(TEMPLATE_FORM_URL_TEMPLATE.format(task_id=task_id), headers=auth_headers(token), timeout=FMS_API_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
@@ -1,48 +1,45 @@
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict
+from form_compiler import compile_template
 
-def print_field(field: Dict[str, Any], indent: int = 2):
-    prefix = ' ' * indent
-    key = field.get('key', '-')
-    label = field.get('label', '-')
-    ftype = field.get('type', '-')
-    print(f"{prefix}- key: {key}, label: {label}, type: {ftype}")
-    # Recursively print nested components
-    for comp_key in ['components', 'columns', 'rows', 'fields']:
-        if comp_key in field and isinstance(field[comp_key], list):
-            for sub in field[comp_key]:
-                print_field(sub, indent + 2)
+def print_field(path: str, field: Dict[str, Any]):
+    # Indent by nesting depth of the component in the form layout
+    prefix = ' ' * (2 * len(field['path']))
+    flags = []
+    if field['required']:
+        flags.append('required')
+    if field['conditional']:
+        flags.append('conditional')
+    if field['choices']:
+        flags.append(f"{len(field['choices'])} choices")
+    extra = f" [{', '.join(flags)}]" if flags else ''
+    print(f"{prefix}- key: {path}, label: {field['label'] or '-'}, type: {field['type'] or '-'}{extra}")
 
-def summarize_form(json_data: Dict[str, Any]):
+def summarize_form(compiled: Dict[str, Any]):
     print("Form Structure Summary:\n")
-    if 'components' in json_data:
-        for section in json_data['components']:
-            legend = section.get('legend', section.get('label', section.get('key', '-')))
-            stype = section.get('type', '-')
-            print(f"Section: {legend} (type: {stype})")
-            if 'components' in section:
-                for field in section['components']:
-                    print_field(field, 4)
-            else:
-                print_field(section, 4)
-    else:
-        print("No 'components' key found at top level.")
+    if not compiled['fields']:
+        print("No fields found in the form template.")
+        return
+    section = None
+    for path, field in compiled['fields'].items():
+        top = field['path'][0] if len(field['path']) > 1 else None
+        if top != section:
+            section = top
+            print(f"Section: {section or '-'}")
+        print_field(path, field)
+    print(f"\n{len(compiled['fields'])} fields, {len(compiled['required'])} required.")
 
 def main():
     with open('api-form.json', encoding='utf-8') as f:
         data = json.load(f)
-    # If 'formTemplate' is present and is a string, parse it
-    if 'formTemplate' in data:
-        form_template = data['formTemplate']
-        if isinstance(form_template, str):
-            try:
-                form_template = json.loads(form_template)
-            except Exception as e:
-                print(f"Error parsing 'formTemplate' as JSON: {e}")
-                return
-        summarize_form(form_template)
-    else:
-        summarize_form(data)
+    # formTemplate arrives double-encoded; the compiler decodes it
+    form_template = data.get('formTemplate', data)
+    try:
+        compiled = compile_template(form_template, data.get('templateId'), data.get('templateName'))
+    except ValueError as e:
+        print(f"Error parsing 'formTemplate' as JSON: {e}")
+        return
+    summarize_form(compiled)
 
 if __name__ == "__main__":
     main()
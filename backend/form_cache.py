@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import fms_api
+
+# Cache for /api/form/<task_id>. Many tasks share one template (e.g.
+# "Maintenance Report"), so template bodies are stored once per templateId and
+# each task keeps only its templateId and formData. Entries are fresh for
+# FORM_CACHE_TTL seconds, then served stale for up to FORM_CACHE_STALE more
+# while one background request refreshes them; concurrent misses for the same
+# task share a single upstream request. After each scrape the board's tasks
+# are prefetched in the background so opening a form is a local lookup.
+
+FORM_CACHE_TTL = int(os.environ.get("FORM_CACHE_TTL", 600))
+FORM_CACHE_STALE = int(os.environ.get("FORM_CACHE_STALE", 3600))
+FORM_TEMPLATE_CACHE_SIZE = int(os.environ.get("FORM_TEMPLATE_CACHE_SIZE", 64))
+FORM_TASK_CACHE_SIZE = int(os.environ.get("FORM_TASK_CACHE_SIZE", 2000))
+# Post-scrape prefetch: concurrent upstream requests across all users, and
+# forms fetched per scrape at most (0 disables prefetching)
+FORM_PREFETCH_CONCURRENCY = int(os.environ.get("FORM_PREFETCH_CONCURRENCY", 4))
+FORM_PREFETCH_BUDGET = int(os.environ.get("FORM_PREFETCH_BUDGET", 100))
+
+TEMPLATE_FIELDS = ("templateId", "templateName", "formTemplate")
+
+
+class LRU:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def peek(self, key):
+        """get() without refreshing the key's recency."""
+        return self._data.get(key)
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FormCache:
+    def __init__(self, fetch=fms_api.fetch_task_form):
+        self.fetch = fetch
+        self.templates = LRU(FORM_TEMPLATE_CACHE_SIZE)  # templateId -> template fields
+        self.tasks = LRU(FORM_TASK_CACHE_SIZE)          # task_id -> {templateId, formData, fetched_at}
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="form-refresh")
+        self._prefetcher = ThreadPoolExecutor(max_workers=max(1, FORM_PREFETCH_CONCURRENCY), thread_name_prefix="form-prefetch")
+        self._prefetching = set()
+        self.counters = {
+            "hit": 0, "stale": 0, "miss": 0, "upstream": 0, "errors": 0,
+            "prefetch_queued": 0, "prefetched": 0, "prefetch_skipped": 0, "prefetch_errors": 0,
+        }
+
+    def _assemble(self, entry):
+        template = self.templates.get(entry["templateId"])
+        if template is None:
+            return None
+        return dict(template, formData=entry["formData"])
+
+    def _store(self, task_id, data):
+        template_id = data.get("templateId")
+        with self._lock:
+            if template_id:
+                self.templates.put(template_id, {k: data.get(k) for k in TEMPLATE_FIELDS})
+                self.tasks.put(task_id, {"templateId": template_id, "formData": data.get("formData"), "fetched_at": time.time()})
+
+    def _load(self, task_id, token):
+        """Fetch from upstream, sharing one request among concurrent callers for task_id."""
+        with self._lock:
+            future = self._inflight.get(task_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[task_id] = Future()
+        if not leader:
+            return future.result()
+        try:
+            self.counters["upstream"] += 1
+            data = self.fetch(task_id, token)
+            self._store(task_id, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            self.counters["errors"] += 1
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(task_id, None)
+
+    def _revalidate(self, task_id, token):
+        try:
+            self._load(task_id, token)
+        except Exception as e:
+            print(f"[FormCache] Background refresh for {task_id} failed, keeping stale copy: {e}", flush=True)
+
+    def get(self, task_id, token):
+        """(form, state) where state is "hit", "stale" or "miss"; upstream errors propagate on a miss."""
+        with self._lock:
+            entry = self.tasks.get(task_id)
+            form = self._assemble(entry) if entry else None
+        if form is not None:
+            age = time.time() - entry["fetched_at"]
+            if age <= FORM_CACHE_TTL:
+                self.counters["hit"] += 1
+                return form, "hit"
+            if age <= FORM_CACHE_TTL + FORM_CACHE_STALE:
+                self.counters["stale"] += 1
+                with self._lock:
+                    refreshing = task_id in self._inflight
+                if not refreshing:
+                    self._refresher.submit(self._revalidate, task_id, token)
+                return form, "stale"
+        self.counters["miss"] += 1
+        return self._load(task_id, token), "miss"
+
+    def _age(self, task_id):
+        """Seconds since task_id was fetched, None when it is not cached (or its template was evicted)."""
+        entry = self.tasks.peek(task_id)
+        if entry is None or self.templates.peek(entry["templateId"]) is None:
+            return None
+        return time.time() - entry["fetched_at"]
+
+    def prefetch(self, task_ids, token, budget=FORM_PREFETCH_BUDGET, on_form=None):
+        """Warm task_ids in the background: uncached first, then stale, at most budget of them.
+
+        Fresh and already queued tasks are skipped. on_form(data) runs after each
+        fetch, e.g. to compile the template. Returns the number queued.
+        """
+        missing, stale = [], []
+        with self._lock:
+            for task_id in dict.fromkeys(task_ids):
+                if task_id in self._inflight or task_id in self._prefetching:
+                    continue
+                age = self._age(task_id)
+                if age is None:
+                    missing.append(task_id)
+                elif age > FORM_CACHE_TTL:
+                    stale.append(task_id)
+            picked = (missing + stale)[:max(0, budget)]
+            self._prefetching.update(picked)
+        self.counters["prefetch_queued"] += len(picked)
+        self.counters["prefetch_skipped"] += len(missing) + len(stale) - len(picked)
+        # One rejected token fails every request in the batch; stop at the first 401
+        rejected = threading.Event()
+        for task_id in picked:
+            self._prefetcher.submit(self._prefetch_one, task_id, token, on_form, rejected)
+        return len(picked)
+
+    def _prefetch_one(self, task_id, token, on_form, rejected):
+        try:
+            if rejected.is_set():
+                return
+            data = self._load(task_id, token)
+            self.counters["prefetched"] += 1
+            if on_form:
+                on_form(data)
+        except Exception as e:
+            self.counters["prefetch_errors"] += 1
+            if getattr(getattr(e, "response", None), "status_code", None) == 401:
+                rejected.set()
+            print(f"[FormCache] Prefetch for {task_id} failed: {e}", flush=True)
+        finally:
+            with self._lock:
+                self._prefetching.discard(task_id)
+
+    def template_id(self, task_id):
+        with self._lock:
+            entry = self.tasks.get(task_id)
+        return entry["templateId"] if entry else None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, templates=len(self.templates), tasks=len(self.tasks), inflight=len(self._inflight),
+                        prefetching=len(self._prefetching))
+
+
+form_cache = FormCache()
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import threading
+from form_cache import LRU
+
+# Compiles Form.io templates once per templateId. Upstream sends formTemplate
+# as a JSON string of several hundred KB, mostly Form.io default keys; the
+# compiled form keeps a pruned component tree for rendering plus a flat
+# key -> field index (data path, required flag, allowed choices) used for
+# server-side validation.
+
+FORM_COMPILED_CACHE_SIZE = int(os.environ.get("FORM_COMPILED_CACHE_SIZE", 64))
+
+CHILD_KEYS = ("components", "columns", "rows", "fields")
+# Component attributes the dashboard renders from; everything else is dropped
+KEEP_KEYS = ("key", "type", "label", "legend", "title", "placeholder", "multiple", "hidden", "defaultValue", "input", "values", "options")
+# Components that nest their children's values under their own key in formData
+ARRAY_CONTAINERS = {"datagrid", "editgrid"}
+OBJECT_CONTAINERS = {"container"}
+CHOICE_TYPES = {"select", "selectboxes", "radio"}
+# Layout and display-only components, never stored in formData
+NON_INPUT_TYPES = {"button", "content", "htmlelement", "panel", "fieldset", "columns", "table", "well", "tabs"}
+
+
+def decode_template(form_template):
+    """formTemplate as a dict; upstream double-encodes it as a JSON string."""
+    if isinstance(form_template, str):
+        return json.loads(form_template)
+    return form_template or {}
+
+
+def _children(component):
+    """Direct child components, flattening columns[].components and rows[][].components."""
+    for child_key in CHILD_KEYS:
+        for item in component.get(child_key) or []:
+            cells = item if isinstance(item, list) else [item]
+            for cell in cells:
+                if not isinstance(cell, dict):
+                    continue
+                if cell.get("type") is None and "components" in cell:
+                    # Column / table cell wrapper without a type of its own
+                    yield from (c for c in cell["components"] if isinstance(c, dict))
+                else:
+                    yield cell
+
+
+def _choices(component):
+    values = (component.get("data") or {}).get("values") or component.get("values") or []
+    choices = [v.get("value") for v in values if isinstance(v, dict) and v.get("value") not in (None, "")]
+    return choices or None
+
+
+def _is_conditional(component):
+    conditional = component.get("conditional") or {}
+    return bool(conditional.get("when") or conditional.get("json") or component.get("customConditional"))
+
+
+def _prune(component):
+    pruned = {k: component[k] for k in KEEP_KEYS if component.get(k) not in (None, "", [], {}, False)}
+    if (component.get("validate") or {}).get("required"):
+        pruned["required"] = True
+    data_values = (component.get("data") or {}).get("values")
+    if data_values:
+        pruned["data"] = {"values": [{"label": v.get("label"), "value": v.get("value")} for v in data_values if isinstance(v, dict)]}
+    if "values" in pruned:
+        pruned["values"] = [{"label": v.get("label"), "value": v.get("value")} for v in pruned["values"] if isinstance(v, dict)]
+    if _is_conditional(component):
+        pruned["conditional"] = True
+    for child_key in CHILD_KEYS:
+        items = component.get(child_key)
+        if not isinstance(items, list) or not items:
+            continue
+        if child_key == "columns":
+            pruned["columns"] = [{"components": [_prune(c) for c in col.get("components") or []]} for col in items if isinstance(col, dict)]
+        elif child_key == "rows":
+            pruned["rows"] = [
+                [{"components": [_prune(c) for c in cell.get("components") or []]} for cell in row if isinstance(cell, dict)]
+                for row in items if isinstance(row, list)
+            ]
+        else:
+            pruned[child_key] = [_prune(c) for c in items if isinstance(c, dict)]
+    return pruned
+
+
+def _index(component, data_path, layout_path, fields, conditional):
+    ctype = component.get("type")
+    key = component.get("key")
+    conditional = conditional or _is_conditional(component)
+    if key and component.get("input") and ctype not in NON_INPUT_TYPES:
+        fields[".".join(data_path + [key])] = {
+            "key": key,
+            "type": ctype,
+            "label": component.get("label"),
+            "data_path": data_path,
+            "path": layout_path + [key],
+            "required": bool((component.get("validate") or {}).get("required")),
+            "conditional": conditional,
+            "multiple": bool(component.get("multiple")) or ctype == "selectboxes",
+            "choices": _choices(component) if ctype in CHOICE_TYPES else None,
+            "container": "array" if ctype in ARRAY_CONTAINERS else "object" if ctype in OBJECT_CONTAINERS else None,
+        }
+    child_data_path = data_path + [key] if key and ctype in ARRAY_CONTAINERS | OBJECT_CONTAINERS else data_path
+    child_layout_path = layout_path + [key] if key else layout_path
+    for child in _children(component):
+        _index(child, child_data_path, child_layout_path, fields, conditional)
+
+
+def compile_template(form_template, template_id=None, template_name=None):
+    """Compile a (possibly string-encoded) Form.io template.
+
+    Returns {templateId, templateName, components, fields, required, choices}.
+    fields maps the dotted data path (e.g. "grid.meterReading") to its
+    component; required lists unconditionally required fields.
+    """
+    template = decode_template(form_template)
+    fields = {}
+    for component in template.get("components") or []:
+        _index(component, [], [], fields, False)
+    return {
+        "templateId": template_id,
+        "templateName": template_name,
+        "components": [_prune(c) for c in template.get("components") or []],
+        "fields": fields,
+        "required": [path for path, f in fields.items() if f["required"] and not f["conditional"]],
+        "choices": {path: f["choices"] for path, f in fields.items() if f["choices"]},
+    }
+
+
+def _values_at(data, data_path):
+    """All values of the containers along data_path: datagrid rows fan out."""
+    values = [data]
+    for key in data_path:
+        nested = []
+        for value in values:
+            child = value.get(key) if isinstance(value, dict) else None
+            nested.extend(child if isinstance(child, list) else [child])
+        values = [v for v in nested if isinstance(v, dict)]
+    return values
+
+
+def _empty(value):
+    if isinstance(value, dict):
+        return not any(value.values())
+    return value in (None, "", [])
+
+
+def validate(compiled, form_data):
+    """Errors for form_data against a compiled form: [{path, error}], empty when valid.
+
+    Checks required fields (conditional ones are skipped, their visibility
+    depends on logic evaluated in the browser) and select/radio/selectboxes
+    values against the template's choices.
+    """
+    errors = []
+    form_data = form_data or {}
+    for path, field in compiled["fields"].items():
+        if field["container"]:
+            continue
+        for scope in _values_at(form_data, field["data_path"]):
+            value = scope.get(field["key"])
+            if _empty(value):
+                if field["required"] and not field["conditional"]:
+                    errors.append({"path": path, "error": f"{field['label'] or field['key']} is required"})
+                continue
+            if not field["choices"]:
+                continue
+            if field["type"] == "selectboxes" and isinstance(value, dict):
+                picked = [k for k, v in value.items() if v]
+            elif isinstance(value, list):
+                picked = value
+            else:
+                picked = [value]
+            unknown = [v for v in picked if v not in field["choices"]]
+            if unknown:
+                errors.append({"path": path, "error": f"Invalid choice for {field['label'] or field['key']}: {unknown}"})
+    return errors
+
+
+class CompiledForms:
+    """Compiled forms by templateId, recompiled only when the template source changes."""
+
+    def __init__(self, maxsize=FORM_COMPILED_CACHE_SIZE):
+        self.forms = LRU(maxsize)
+        self._lock = threading.Lock()
+        self.counters = {"hit": 0, "compiled": 0, "compile_seconds": 0.0}
+
+    def get(self, template_id, form_template, template_name=None):
+        with self._lock:
+            entry = self.forms.get(template_id) if template_id else None
+        # The template string is compared by value; an unchanged one is usually the same object
+        if entry and entry["source"] == form_template:
+            self.counters["hit"] += 1
+            return entry["compiled"]
+        started = time.perf_counter()
+        compiled = compile_template(form_template, template_id, template_name)
+        self.counters["compiled"] += 1
+        self.counters["compile_seconds"] += time.perf_counter() - started
+        if template_id:
+            with self._lock:
+                self.forms.put(template_id, {"source": form_template, "compiled": compiled})
+        return compiled
+
+    def for_form(self, form):
+        """Compiled form for an /api/form payload ({templateId, templateName, formTemplate, ...})."""
+        return self.get(form.get("templateId"), form.get("formTemplate"), form.get("templateName"))
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, compile_seconds=round(self.counters["compile_seconds"], 3), forms=len(self.forms))
+
+
+compiled_forms = CompiledForms()
@@ -0,0 +1,250 @@
+import os
+import time
+import asyncio
+import itertools
+import threading
+import weakref
+
+# Event-driven page readiness for the Playwright flows: wait on a concrete
+# signal (FMS API traffic settling, an element count holding still, Angular
+# reporting stable, the URL leaving SSO) with an upper bound instead of fixed
+# sleeps. Waits never raise on timeout; they return False and the flow carries
+# on as it did after the old sleep. Every wait records how long it took.
+
+READY_TIMEOUT = int(os.environ.get("READY_TIMEOUT_MS", 15000))
+# How long a signal must hold still before the page counts as settled
+READY_QUIET_MS = int(os.environ.get("READY_QUIET_MS", 400))
+READY_POLL_MS = 100
+# Requests to this host are what populate the board, modals and worker search
+API_URL_PART = "fmsapi.el.earthlink.iq"
+
+# State lives on the page between polls; callId keeps a later wait for the
+# same selector on a pooled page from inheriting an earlier wait's count.
+STABLE_COUNT_JS = """([selector, quietMs, minCount, callId]) => {
+    const key = '__readyCount:' + selector;
+    const n = document.querySelectorAll(selector).length;
+    const now = performance.now();
+    const prev = window[key];
+    if (!prev || prev.callId !== callId || prev.n !== n) {
+        window[key] = {callId: callId, n: n, since: now};
+        return false;
+    }
+    return n >= minCount && now - prev.since >= quietMs;
+}"""
+
+# Resolves true once every Angular app on the page has no pending macrotasks
+# or HTTP calls, false on timeout, null when the page exposes no testability.
+ANGULAR_STABLE_JS = """(timeout) => new Promise((resolve) => {
+    const all = window.getAllAngularTestabilities ? window.getAllAngularTestabilities() : [];
+    if (!all.length) { resolve(null); return; }
+    let pending = all.length;
+    const timer = setTimeout(() => resolve(false), timeout);
+    all.forEach((t) => t.whenStable(() => {
+        if (--pending === 0) { clearTimeout(timer); resolve(true); }
+    }));
+})"""
+
+TEXT_IN_JS = """([selector, text]) => Array.from(document.querySelectorAll(selector))
+    .some((el) => el.innerText.toLowerCase().includes(text.toLowerCase()))"""
+
+_stats = {}
+_stats_lock = threading.Lock()
+_wait_ids = itertools.count(1)
+
+
+def _record(label, started, ok):
+    elapsed = time.monotonic() - started
+    with _stats_lock:
+        entry = _stats.setdefault(label, {"count": 0, "timeouts": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+        entry["count"] += 1
+        entry["total"] += elapsed
+        entry["max"] = max(entry["max"], elapsed)
+        entry["last"] = elapsed
+        if not ok:
+            entry["timeouts"] += 1
+    if not ok:
+        print(f"[Ready] {label} not ready after {elapsed:.2f}s, continuing.", flush=True)
+    return ok
+
+
+def stats():
+    """{label: {count, timeouts, avg, max, last}} in seconds for every wait so far."""
+    with _stats_lock:
+        return {
+            label: {
+                "count": e["count"],
+                "timeouts": e["timeouts"],
+                "avg": round(e["total"] / e["count"], 3),
+                "max": round(e["max"], 3),
+                "last": round(e["last"], 3),
+            }
+            for label, e in _stats.items()
+        }
+
+
+class ApiActivity:
+    """In-flight request count and last change time for one page's FMS API calls."""
+
+    def __init__(self, url_part):
+        self.url_part = url_part
+        self.in_flight = set()
+        self.last_change = time.monotonic()
+
+    def _started(self, request):
+        if self.url_part in request.url:
+            self.in_flight.add(request)
+            self.last_change = time.monotonic()
+
+    def _finished(self, request):
+        if request in self.in_flight:
+            self.in_flight.discard(request)
+            self.last_change = time.monotonic()
+
+    def idle_for(self):
+        """Seconds since the last API request started or finished, 0 while any is pending."""
+        if self.in_flight:
+            return 0
+        return time.monotonic() - self.last_change
+
+
+_trackers = weakref.WeakKeyDictionary()
+
+
+def track_api(page, url_part=API_URL_PART):
+    """Start counting API requests on page; call once right after new_page()."""
+    tracker = _trackers.get(page)
+    if tracker is None:
+        tracker = ApiActivity(url_part)
+        page.on("request", tracker._started)
+        page.on("requestfinished", tracker._finished)
+        page.on("requestfailed", tracker._finished)
+        _trackers[page] = tracker
+    return tracker
+
+
+# --- async API (scraper.py) ---
+
+async def wait_api_idle(page, label, quiet_ms=READY_QUIET_MS, timeout=READY_TIMEOUT):
+    tracker = track_api(page)
+    started = time.monotonic()
+    deadline = started + timeout / 1000
+    while tracker.idle_for() < quiet_ms / 1000:
+        if time.monotonic() >= deadline:
+            return _record(label, started, False)
+        await asyncio.sleep(READY_POLL_MS / 1000)
+    return _record(label, started, True)
+
+
+async def wait_stable_count(page, label, selector, min_count=0, quiet_ms=READY_QUIET_MS, timeout=READY_TIMEOUT):
+    started = time.monotonic()
+    try:
+        await page.wait_for_function(STABLE_COUNT_JS, arg=[selector, quiet_ms, min_count, next(_wait_ids)], polling=READY_POLL_MS, timeout=timeout)
+        return _record(label, started, True)
+    except Exception:
+        return _record(label, started, False)
+
+
+async def wait_angular_stable(page, label, timeout=READY_TIMEOUT):
+    """True when Angular is stable; None when the page has no testability hooks."""
+    started = time.monotonic()
+    try:
+        result = await page.evaluate(ANGULAR_STABLE_JS, timeout)
+    except Exception:
+        result = False
+    if result is None:
+        return None
+    return _record(label, started, result)
+
+
+async def wait_url(page, label, predicate, timeout=READY_TIMEOUT):
+    started = time.monotonic()
+    try:
+        await page.wait_for_url(predicate, timeout=timeout)
+        return _record(label, started, True)
+    except Exception:
+        return _record(label, started, False)
+
+
+async def wait_detached(page, label, selector, timeout=READY_TIMEOUT):
+    started = time.monotonic()
+    try:
+        await page.wait_for_selector(selector, state="detached", timeout=timeout)
+        return _record(label, started, True)
+    except Exception:
+        return _record(label, started, False)
+
+
+async def wait_board_ready(page, label="board", timeout=READY_TIMEOUT, min_count=0):
+    """Board columns are filled: Angular (or the API) has settled and the card count holds at min_count or more."""
+    if await wait_angular_stable(page, f"{label}.angular", timeout) is None:
+        await wait_api_idle(page, f"{label}.api", timeout=timeout)
+    return await wait_stable_count(page, f"{label}.cards", ".board-col board-task-box", min_count=min_count, timeout=timeout)
+
+
+# --- sync API (add_technician.py, token script) ---
+
+def wait_api_idle_sync(page, label, quiet_ms=READY_QUIET_MS, timeout=READY_TIMEOUT):
+    tracker = track_api(page)
+    started = time.monotonic()
+    deadline = started + timeout / 1000
+    while tracker.idle_for() < quiet_ms / 1000:
+        if time.monotonic() >= deadline:
+            return _record(label, started, False)
+        # Yields to Playwright's dispatcher so request events keep arriving
+        page.wait_for_timeout(READY_POLL_MS)
+    return _record(label, started, True)
+
+
+def wait_stable_count_sync(page, label, selector, min_count=0, quiet_ms=READY_QUIET_MS, timeout=READY_TIMEOUT):
+    started = time.monotonic()
+    try:
+        page.wait_for_function(STABLE_COUNT_JS, arg=[selector, quiet_ms, min_count, next(_wait_ids)], polling=READY_POLL_MS, timeout=timeout)
+        return _record(label, started, True)
+    except Exception:
+        return _record(label, started, False)
+
+
+def wait_angular_stable_sync(page, label, timeout=READY_TIMEOUT):
+    started = time.monotonic()
+    try:
+        result = page.evaluate(ANGULAR_STABLE_JS, timeout)
+    except Exception:
+        result = False
+    if result is None:
+        return None
+    return _record(label, started, result)
+
+
+def wait_url_sync(page, label, predicate, timeout=READY_TIMEOUT):
+    started = time.monotonic()
+    try:
+        page.wait_for_url(predicate, timeout=timeout)
+        return _record(label, started, True)
+    except Exception:
+        return _record(label, started, False)
+
+
+def wait_text_sync(page, label, selector, text, timeout=READY_TIMEOUT):
+    """Some element matching selector contains text (case-insensitive)."""
+    started = time.monotonic()
+    try:
+        page.wait_for_function(TEXT_IN_JS, arg=[selector, text], polling=READY_POLL_MS, timeout=timeout)
+        return _record(label, started, True)
+    except Exception:
+        return _record(label, started, False)
+
+
+def wait_element_sync(handle, label, states=("visible", "enabled"), timeout=READY_TIMEOUT):
+    started = time.monotonic()
+    try:
+        for state in states:
+            handle.wait_for_element_state(state, timeout=timeout)
+        return _record(label, started, True)
+    except Exception:
+        return _record(label, started, False)
+
+
+def wait_board_ready_sync(page, label="board", timeout=READY_TIMEOUT):
+    if wait_angular_stable_sync(page, f"{label}.angular", timeout) is None:
+        wait_api_idle_sync(page, f"{label}.api", timeout=timeout)
+    return wait_stable_count_sync(page, f"{label}.cards", ".board-col board-task-box", timeout=timeout)
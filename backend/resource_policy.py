@@ -0,0 +1,197 @@
+import os
+import threading
+
+# Request blocking for every Playwright context. The flows only read DOM text
+# and click through the board, so images, fonts, media and third-party
+# analytics never need to reach the network.
+#
+# Two mechanisms, picked per flow:
+#   "route" - context.route() decides per request by resource type and URL,
+#             stubbing or aborting. Playwright turns the HTTP cache off for
+#             routed contexts, which costs nothing for the one-shot
+#             add_technician / token browsers (their cache starts empty).
+#   "cdp"   - Chromium's Network.setBlockedURLs with URL patterns derived from
+#             the same lists. Used for the pooled scraper contexts so the SPA
+#             bundles stay in the HTTP cache between scrapes.
+#
+# Configuration (comma-separated lists):
+#   RESOURCE_POLICY=off                 disable blocking entirely
+#   RESOURCE_BLOCK_<FLOW>=image,font    resource types blocked for one flow
+#                                       (flows: SCRAPE, ASSIGN, TOKEN)
+#   RESOURCE_DENY_URLS=...              URL substrings always blocked
+#   RESOURCE_ALLOW_URLS=...             URL substrings never blocked (route
+#                                       mode; in cdp mode they only exempt
+#                                       matching deny entries)
+
+RESOURCE_POLICY_ENABLED = os.environ.get("RESOURCE_POLICY", "on") != "off"
+
+DEFAULT_BLOCK_TYPES = ["image", "media", "font"]
+# Per-flow overrides. Flows that click through modals keep CSS, since layout
+# decides what is clickable and what innerText returns.
+FLOW_BLOCK_TYPES = {
+    "scrape": DEFAULT_BLOCK_TYPES,
+    "assign": DEFAULT_BLOCK_TYPES,
+    # The token flow only needs sessionStorage once the board has loaded
+    "token": DEFAULT_BLOCK_TYPES + ["stylesheet"],
+}
+FLOW_MODES = {"scrape": "cdp", "assign": "route", "token": "route"}
+DEFAULT_DENY_URLS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "hotjar.com",
+    "clarity.ms",
+    "facebook.net",
+]
+# Blocked requests of these types get an empty 200 instead of a network
+# error, so app code awaiting them does not take its error path.
+STUB_TYPES = {"script", "xhr", "fetch", "stylesheet"}
+# URL patterns standing in for resource types where only URLs can be matched
+TYPE_URL_PATTERNS = {
+    "image": ["png", "jpg", "jpeg", "gif", "webp", "ico", "svg", "bmp"],
+    "font": ["woff", "woff2", "ttf", "otf", "eot"],
+    "media": ["mp4", "webm", "mp3", "ogg", "wav"],
+    "stylesheet": ["css"],
+}
+
+
+def _env_list(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return list(default)
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+class ResourcePolicy:
+    def __init__(self, flow):
+        self.flow = flow
+        self.block_types = set(_env_list(f"RESOURCE_BLOCK_{flow.upper()}", FLOW_BLOCK_TYPES.get(flow, DEFAULT_BLOCK_TYPES)))
+        self.allow_urls = _env_list("RESOURCE_ALLOW_URLS", [])
+        self.deny_urls = _env_list("RESOURCE_DENY_URLS", DEFAULT_DENY_URLS)
+
+    def action(self, resource_type, url):
+        """None to let the request through, else "stub" or "abort"."""
+        if any(part in url for part in self.allow_urls):
+            return None
+        if resource_type in self.block_types or any(part in url for part in self.deny_urls):
+            return "stub" if resource_type in STUB_TYPES else "abort"
+        return None
+
+    def blocked_url_patterns(self):
+        """Wildcard patterns for Network.setBlockedURLs."""
+        patterns = []
+        for resource_type in sorted(self.block_types):
+            for ext in TYPE_URL_PATTERNS.get(resource_type, []):
+                patterns += [f"*.{ext}", f"*.{ext}?*"]
+        for part in self.deny_urls:
+            if not any(allowed in part for allowed in self.allow_urls):
+                patterns.append(f"*{part}*")
+        return patterns
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _flow_stats(flow):
+    return _stats.setdefault(flow, {
+        "allowed_requests": 0,
+        "allowed_bytes": 0,
+        "blocked_requests": 0,
+        "blocked_by_type": {},
+    })
+
+
+def _count_blocked(flow, resource_type):
+    with _stats_lock:
+        entry = _flow_stats(flow)
+        entry["blocked_requests"] += 1
+        entry["blocked_by_type"][resource_type] = entry["blocked_by_type"].get(resource_type, 0) + 1
+
+
+def _count_response(flow, response):
+    try:
+        size = int(response.headers.get("content-length") or 0)
+    except (ValueError, TypeError):
+        size = 0
+    with _stats_lock:
+        entry = _flow_stats(flow)
+        entry["allowed_requests"] += 1
+        entry["allowed_bytes"] += size
+
+
+def _count_failed(flow, request):
+    if "ERR_BLOCKED_BY_CLIENT" in (request.failure or ""):
+        _count_blocked(flow, request.resource_type)
+
+
+def stats():
+    """{flow: {allowed_requests, allowed_bytes, blocked_requests, blocked_by_type}}.
+
+    Blocked requests never download, so they are counted rather than sized;
+    allowed_bytes comes from Content-Length and undercounts chunked bodies.
+    """
+    with _stats_lock:
+        return {flow: dict(e, blocked_by_type=dict(e["blocked_by_type"])) for flow, e in _stats.items()}
+
+
+async def apply_async(context, page, flow):
+    """Install the flow's policy on an async context and its page."""
+    if not RESOURCE_POLICY_ENABLED:
+        return
+    policy = ResourcePolicy(flow)
+    context.on("response", lambda response: _count_response(flow, response))
+    if FLOW_MODES.get(flow, "route") == "cdp":
+        try:
+            cdp = await context.new_cdp_session(page)
+            await cdp.send("Network.enable")
+            await cdp.send("Network.setBlockedURLs", {"urls": policy.blocked_url_patterns()})
+            page.on("requestfailed", lambda request: _count_failed(flow, request))
+            return
+        except Exception as e:
+            print(f"[Resources] CDP blocking unavailable for {flow}, routing instead: {e}", flush=True)
+
+    async def handle(route):
+        request = route.request
+        action = policy.action(request.resource_type, request.url)
+        if action is None:
+            await route.continue_()
+            return
+        _count_blocked(flow, request.resource_type)
+        if action == "stub":
+            await route.fulfill(status=200, body="")
+        else:
+            await route.abort("blockedbyclient")
+
+    await context.route("**/*", handle)
+
+
+def apply_sync(context, page, flow):
+    """Install the flow's policy on a sync context and its page."""
+    if not RESOURCE_POLICY_ENABLED:
+        return
+    policy = ResourcePolicy(flow)
+    context.on("response", lambda response: _count_response(flow, response))
+    if FLOW_MODES.get(flow, "route") == "cdp":
+        try:
+            cdp = context.new_cdp_session(page)
+            cdp.send("Network.enable")
+            cdp.send("Network.setBlockedURLs", {"urls": policy.blocked_url_patterns()})
+            page.on("requestfailed", lambda request: _count_failed(flow, request))
+            return
+        except Exception as e:
+            print(f"[Resources] CDP blocking unavailable for {flow}, routing instead: {e}", flush=True)
+
+    def handle(route):
+        request = route.request
+        action = policy.action(request.resource_type, request.url)
+        if action is None:
+            route.continue_()
+            return
+        _count_blocked(flow, request.resource_type)
+        if action == "stub":
+            route.fulfill(status=200, body="")
+        else:
+            route.abort("blockedbyclient")
+
+    context.route("**/*", handle)
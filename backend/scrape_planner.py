@@ -0,0 +1,171 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Decides when each user's board is scraped next instead of a fixed 120 s
+# sleep: users with a dashboard open are refreshed often, boards that keep
+# changing are polled faster than quiet ones, idle accounts and off-hours
+# slow down, failures back off, and the whole process stays within an hourly
+# scrape budget against the upstream site.
+
+# Base interval by engagement: a dashboard is connected over SSE, a client
+# polled within ACTIVITY_WINDOW seconds, or nobody is looking
+ACTIVE_INTERVAL = int(os.environ.get("SCRAPE_ACTIVE_INTERVAL", 45))
+RECENT_INTERVAL = int(os.environ.get("SCRAPE_RECENT_INTERVAL", 120))
+IDLE_INTERVAL = int(os.environ.get("SCRAPE_IDLE_INTERVAL", 900))
+ACTIVITY_WINDOW = int(os.environ.get("SCRAPE_ACTIVITY_WINDOW", 600))
+MIN_INTERVAL = 30
+MAX_INTERVAL = 3600
+# Local hours (start-end, end exclusive) when dispatchers work; outside them
+# intervals for unwatched users stretch by OFF_HOURS_FACTOR
+WORK_HOURS = os.environ.get("SCRAPE_WORK_HOURS", "7-22")
+OFF_HOURS_FACTOR = 4
+# Upper bound on scrapes started per rolling hour, across all users
+SCRAPE_BUDGET_PER_HOUR = int(os.environ.get("SCRAPE_BUDGET_PER_HOUR", 180))
+# Failure backoff: first delay and cap, doubled per consecutive failure
+FAILED_BACKOFF = (60, 1800)
+FORBIDDEN_BACKOFF = (900, 7200)
+# Weight of the latest scrape in the board change rate
+CHANGE_RATE_ALPHA = 0.3
+
+ENGAGEMENT_RANK = {"active": 0, "recent": 1, "idle": 2}
+
+
+def in_work_hours(now=None):
+    try:
+        start, end = (int(h) for h in WORK_HOURS.split("-"))
+    except ValueError:
+        return True
+    hour = time.localtime(now).tm_hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+class ScrapePlanner:
+    def __init__(self, watchers=None, budget_per_hour=SCRAPE_BUDGET_PER_HOUR, baseline="idle"):
+        # watchers(username) -> number of connected dashboards
+        self.watchers = watchers or (lambda username: 0)
+        self.budget_per_hour = budget_per_hour
+        # Lowest engagement assumed for a user (the CLI loop uses "recent")
+        self.baseline = baseline
+        self.users = {}
+        self.last_activity = {}
+        self._starts = deque()
+        self._budget_warned = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def _state(self, username):
+        return self.users.setdefault(username, {
+            "last_scraped": 0,
+            "backoff_until": 0,
+            "failures": 0,
+            "change_rate": 0.5,
+            "last_status": None,
+        })
+
+    def note_activity(self, username):
+        """A client polled username's board."""
+        self.last_activity[username] = time.time()
+
+    def wake(self):
+        """Re-plan now, e.g. when a dashboard connects."""
+        self._wake.set()
+
+    def wait(self, timeout):
+        self._wake.wait(max(0, timeout))
+        self._wake.clear()
+
+    def engagement(self, username, now=None):
+        now = now or time.time()
+        if self.watchers(username) > 0:
+            level = "active"
+        elif now - self.last_activity.get(username, 0) < ACTIVITY_WINDOW:
+            level = "recent"
+        else:
+            level = "idle"
+        return min(level, self.baseline, key=ENGAGEMENT_RANK.get)
+
+    def interval(self, username, now=None):
+        now = now or time.time()
+        state = self._state(username)
+        level = self.engagement(username, now)
+        interval = {"active": ACTIVE_INTERVAL, "recent": RECENT_INTERVAL, "idle": IDLE_INTERVAL}[level]
+        if state["change_rate"] >= 0.5:
+            interval *= 0.6
+        elif state["change_rate"] < 0.1:
+            interval *= 1.5
+        if level != "active" and not in_work_hours(now):
+            interval *= OFF_HOURS_FACTOR
+        return max(MIN_INTERVAL, min(MAX_INTERVAL, interval))
+
+    def next_due(self, username, now=None):
+        state = self._state(username)
+        return max(state["last_scraped"] + self.interval(username, now), state["backoff_until"])
+
+    def due(self, usernames, now=None):
+        """Users to scrape now, most engaged first, within the hourly budget."""
+        now = now or time.time()
+        with self._lock:
+            while self._starts and self._starts[0] <= now - 3600:
+                self._starts.popleft()
+            candidates = [u for u in usernames if self.next_due(u, now) <= now]
+            candidates.sort(key=lambda u: (ENGAGEMENT_RANK[self.engagement(u, now)], self.next_due(u, now)))
+            remaining = max(0, self.budget_per_hour - len(self._starts))
+            if len(candidates) > remaining:
+                if not self._budget_warned:
+                    print(f"[Planner] Hourly budget of {self.budget_per_hour} scrapes reached, deferring "
+                          f"{len(candidates) - remaining} user(s).", flush=True)
+                    self._budget_warned = True
+                candidates = candidates[:remaining]
+            else:
+                self._budget_warned = False
+            self._starts.extend([now] * len(candidates))
+            return candidates
+
+    def record(self, username, status, changed, now=None):
+        """Feed back one scrape's outcome; changed is whether the board differed from before."""
+        now = now or time.time()
+        with self._lock:
+            state = self._state(username)
+            state["last_status"] = status
+            if status == "skipped":
+                return
+            state["last_scraped"] = now
+            if status in ("forbidden", "failed"):
+                state["failures"] += 1
+                first, cap = FORBIDDEN_BACKOFF if status == "forbidden" else FAILED_BACKOFF
+                delay = min(cap, first * 2 ** (state["failures"] - 1))
+                state["backoff_until"] = now + delay
+                print(f"[Planner] {username} {status} {state['failures']}x, backing off {delay}s.", flush=True)
+                return
+            state["failures"] = 0
+            state["backoff_until"] = 0
+            state["change_rate"] = (1 - CHANGE_RATE_ALPHA) * state["change_rate"] + CHANGE_RATE_ALPHA * (1 if changed else 0)
+
+    def seconds_until_next(self, usernames, now=None):
+        now = now or time.time()
+        if not usernames:
+            return MAX_INTERVAL
+        return max(0, min(self.next_due(u, now) for u in usernames) - now)
+
+    def snapshot(self, usernames):
+        now = time.time()
+        with self._lock:
+            used = sum(1 for t in self._starts if t > now - 3600)
+        return {
+            "budget_per_hour": self.budget_per_hour,
+            "budget_used": used,
+            "work_hours": in_work_hours(now),
+            "users": {
+                u: {
+                    "engagement": self.engagement(u, now),
+                    "interval": round(self.interval(u, now)),
+                    "next_in": round(max(0, self.next_due(u, now) - now)),
+                    "change_rate": round(self._state(u)["change_rate"], 2),
+                    "failures": self._state(u)["failures"],
+                    "last_status": self._state(u)["last_status"],
+                }
+                for u in usernames
+            },
+        }
@@ -5,314 +5,882 @@ def get_platform_encoding():
 import os
 import sys
 import time
+import threading
 from playwright.async_api import async_playwright
 import json
 import asyncio
+import contextlib
+import session_cache
+import fms_api
+import task_store
+import readiness
+import resource_policy
+from browser_scheduler import scheduler, INTERACTIVE, BACKGROUND, TOKEN
+from token_manager import token_manager
+from form_cache import form_cache
+from form_compiler import compiled_forms
+from scrape_planner import ScrapePlanner
+from fingerprint_index import FingerprintIndex, card_fingerprint
 
 LOGIN_URL = "https://sso.earthlink.iq/auth/realms/elcld.ai/protocol/openid-connect/auth?response_type=code&client_id=fms-msp&redirect_uri=https%3A%2F%2Fmsp.go2field.iq%2Fboard%2Fmy-unit-tasks&scope=openid"
+BOARD_URL = "https://msp.go2field.iq/board/a22c39cb-093c-d83e-7dd1-a8c7a5d0fa7b"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ERRORS_DIR = os.path.join(BASE_DIR, "Errors")
+SCRAPED_RESULTS_DIR = os.path.join(BASE_DIR, "scraped_results")
+
+# Browser pool tuning: the Chromium process is kept warm between scrapes and
+# recycled after BROWSER_MAX_AGE seconds or BROWSER_MAX_USES scrapes; per-user
+# contexts are rebuilt after CONTEXT_MAX_AGE seconds.
+BROWSER_MAX_AGE = int(os.environ.get("SCRAPER_BROWSER_MAX_AGE", 3600))
+BROWSER_MAX_USES = int(os.environ.get("SCRAPER_BROWSER_MAX_USES", 100))
+CONTEXT_MAX_AGE = int(os.environ.get("SCRAPER_CONTEXT_MAX_AGE", 1800))
+
+# Multi-user scraping: how many users scrape at once on the shared browser,
+# and how many extra attempts a failing user gets within one cycle.
+SCRAPE_CONCURRENCY = int(os.environ.get("SCRAPE_CONCURRENCY", 3))
+SCRAPE_USER_RETRIES = int(os.environ.get("SCRAPE_USER_RETRIES", 1))
+
+# "evaluate" reads the whole board in one in-page call; "dom" is the legacy
+# per-card query_selector path.
+SCRAPER_EXTRACT_MODE = os.environ.get("SCRAPER_EXTRACT_MODE", "evaluate")
+BOARD_COLUMNS = ["New", "Pending", "In Progress"]
+# "api" pulls notes for all cards over the FMS REST API and only opens the
+# Notes modal for cards the API could not serve; "modal" always clicks.
+SCRAPER_NOTES_SOURCE = os.environ.get("SCRAPER_NOTES_SOURCE", "api")
+# Results go to the SQLite task store; set SCRAPER_WRITE_CSV=1 to also keep
+# the old scraped_results/scraped_*.csv snapshots.
+SCRAPER_WRITE_CSV = os.environ.get("SCRAPER_WRITE_CSV", "0") == "1"
+
+# Returns {titles: [...], cards: [{Column, CaseNumber, Title, FBG, CardText, uuid, colIndex, cardIndex, noteHint}]}
+BOARD_EXTRACT_JS = """(wanted) => {
+    const text = (el) => el ? el.innerText : "";
+    const cols = Array.from(document.querySelectorAll('.board-col'));
+    const titles = cols.map(c => text(c.querySelector('.board-col-title h5')));
+    const cards = [];
+    for (const colTitle of wanted) {
+        const colIndex = titles.indexOf(colTitle);
+        if (colIndex === -1) continue;
+        const boxes = cols[colIndex].querySelectorAll('board-task-box');
+        boxes.forEach((card, cardIndex) => {
+            let fbg = text(card.querySelector('.task-info[title^="FBG"]'));
+            if (!fbg) {
+                for (const info of card.querySelectorAll('.task-info')) {
+                    const txt = info.innerText.trim();
+                    if (txt.startsWith("FBG")) { fbg = txt; break; }
+                }
+            }
+            const link = card.querySelector('.action-buttons a[tooltip="View task in new tab"][target="_blank"]');
+            const href = link ? link.getAttribute('href') : null;
+            const uuid = href && href.includes('/task/') ? href.split('/task/').pop() : null;
+            // Note count badges / unread styling on the Notes button feed the card fingerprint
+            const notesBtn = card.querySelector('.action-buttons a[tooltip="Notes"]');
+            const noteHint = notesBtn ? [notesBtn.innerText, notesBtn.className, notesBtn.getAttribute('title') || ''].join('|') : '';
+            cards.push({
+                Column: colTitle,
+                CaseNumber: text(card.querySelector('.task-code')),
+                Title: text(card.querySelector('.task-name a')),
+                FBG: fbg,
+                CardText: card.innerText,
+                uuid: uuid,
+                colIndex: colIndex,
+                cardIndex: cardIndex,
+                noteHint: noteHint
+            });
+        });
+    }
+    return {titles: titles, cards: cards};
+}"""
+
+class SessionExpired(Exception):
+    """Raised when the board redirects back to the SSO login form."""
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
 
 class ScraperSessionManager:
     def __init__(self):
+        # username -> {"context", "page", "created_at", "uses", "lock", "authenticated"}
         self.sessions = {}
+        self.playwright = None
+        self.browser = None
+        self.browser_started_at = 0
+        self.browser_uses = 0
+        self.active_scrapes = 0
+        # username -> outcome of that user's latest scrape (status, timing, card count)
+        self.last_results = {}
+        self.loop = None
+        self.loop_thread = None
+        self._pool_lock = None
 
-    async def scrape_with_session(self, username, password):
-        print("\n--- Scraper run started ---", flush=True)
+    # --- Dedicated event loop so the pool outlives a single request/cycle ---
+
+    def start_loop(self):
+        if self.loop and self.loop_thread and self.loop_thread.is_alive():
+            return self.loop
+        self.loop = asyncio.new_event_loop()
+        def run_loop():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_forever()
+        self.loop_thread = threading.Thread(target=run_loop, name="scraper-pool-loop", daemon=True)
+        self.loop_thread.start()
+        print("[Pool] Scraper event loop thread started.", flush=True)
+        return self.loop
+
+    def attach_loop(self, loop):
+        """Use an already running loop (the ASGI server's) instead of a private thread."""
+        self.loop = loop
+        self.loop_thread = threading.current_thread()
+        print("[Pool] Scraper pool attached to the server event loop.", flush=True)
+
+    def submit(self, coro):
+        """Schedule a coroutine on the pool's event loop without waiting; returns a concurrent Future."""
+        self.start_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the pool's event loop from any thread and wait for it."""
+        self.start_loop()
+        if threading.current_thread() is self.loop_thread:
+            coro.close()
+            raise RuntimeError("scraper_manager.run() called on the pool loop; await the coroutine instead")
+        return self.submit(coro).result(timeout)
+
+    # --- Browser pool ---
+
+    def _get_pool_lock(self):
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        return self._pool_lock
+
+    def browser_healthy(self):
+        return self.browser is not None and self.browser.is_connected()
+
+    def browser_expired(self):
+        if not self.browser:
+            return False
+        age = time.time() - self.browser_started_at
+        return age > BROWSER_MAX_AGE or self.browser_uses >= BROWSER_MAX_USES
+
+    async def ensure_browser(self):
+        async with self._get_pool_lock():
+            if self.browser and not self.browser_healthy():
+                print("[Pool] Browser health check failed, relaunching Chromium.", flush=True)
+                await self._close_browser()
+            elif self.browser_expired() and self.active_scrapes <= 1:
+                # Callers hold browser_in_use(), so 1 means only the caller itself
+                print(f"[Pool] Recycling browser after {self.browser_uses} uses / {int(time.time() - self.browser_started_at)}s.", flush=True)
+                await self._close_browser()
+            if self.browser:
+                return self.browser
+            if not self.playwright:
+                print("Starting Playwright...", flush=True)
+                self.playwright = await async_playwright().start()
+            print("[Pool] Launching warm Chromium instance...", flush=True)
+            self.browser = await self.playwright.chromium.launch(headless=True)
+            self.browser_started_at = time.time()
+            self.browser_uses = 0
+            return self.browser
+
+    @contextlib.asynccontextmanager
+    async def browser_in_use(self):
+        """Keep ensure_browser from recycling the browser while the caller works in it.
+
+        Enter before ensure_browser/get_session so the caller counts from the start.
+        """
+        self.active_scrapes += 1
+        try:
+            yield
+        finally:
+            self.active_scrapes -= 1
+
+    async def _close_browser(self):
+        for username in list(self.sessions.keys()):
+            await self.close_session(username)
+        if self.browser:
+            try:
+                await self.browser.close()
+            except Exception as e:
+                print(f"[Pool] Error closing browser: {e}", flush=True)
+        self.browser = None
+
+    async def get_session(self, username):
+        browser = await self.ensure_browser()
+        session = self.sessions.get(username)
+        if session:
+            expired = time.time() - session["created_at"] > CONTEXT_MAX_AGE
+            if expired or session["page"].is_closed():
+                print(f"[Pool] Rebuilding context for {username} ({'expired' if expired else 'page closed'}).", flush=True)
+                await self.close_session(username)
+                session = None
+        if session:
+            print(f"Reusing session for user: {username}", flush=True)
+            return session
+        print(f"Creating new session for user: {username}", flush=True)
+        storage_state = await asyncio.to_thread(session_cache.load_state, username)
+        context = await browser.new_context(
+            storage_state=storage_state,
+            user_agent=USER_AGENT,
+            viewport={"width": 1280, "height": 800},
+            extra_http_headers={"Accept-Language": "en-US,en;q=0.9"},
+        )
+        page = await context.new_page()
+        await resource_policy.apply_async(context, page, "scrape")
+        readiness.track_api(page)
+        session = {
+            "context": context,
+            "page": page,
+            "created_at": time.time(),
+            "uses": 0,
+            "lock": asyncio.Lock(),
+            "authenticated": storage_state is not None,
+        }
+        self.sessions[username] = session
+        return session
+
+    async def close_session(self, username):
+        session = self.sessions.pop(username, None)
+        if not session:
+            return
+        try:
+            await session["context"].close()
+        except Exception as e:
+            print(f"[Pool] Error closing context for {username}: {e}", flush=True)
+
+    async def shutdown(self):
+        async with self._get_pool_lock():
+            await self._close_browser()
+            if self.playwright:
+                await self.playwright.stop()
+                self.playwright = None
+
+    # --- Scrape flow ---
+
+    async def _login(self, page, username, password):
+        print("Navigating to login page...", flush=True)
+        await page.goto(LOGIN_URL)
+        if not await page.query_selector('#username'):
+            print("Existing session still authenticated, skipping login.", flush=True)
+            return
+        print("Filling username...", flush=True)
+        await page.fill('//*[@id="username"]', username)
+        print("Filling password...", flush=True)
+        await page.fill('//*[@id="password"]', password)
+        print("Clicking sign in...", flush=True)
+        await page.click('//*[@id="kc-form-buttons"]')
+        print("Waiting for OTP/password page...", flush=True)
+        await page.wait_for_url("**/login-actions/authenticate?*", timeout=30000)
+        print("Filling OTP/password again...", flush=True)
+        await page.fill('//*[@id="pi_otp"]', password)
+        print("Clicking confirm...", flush=True)
+        await page.click('//*[@id="kc-login"]')
+        print("Waiting for page to load after confirm...", flush=True)
+        await readiness.wait_url(page, "login.redirect", lambda url: not session_cache.is_sso_url(url), timeout=30000)
+        print("Login and initial navigation complete.", flush=True)
+
+    async def _open_board(self, page):
+        max_retries = 4
+        for attempt in range(max_retries):
+            try:
+                await page.goto(BOARD_URL, wait_until="domcontentloaded", timeout=90000)
+                if session_cache.is_sso_url(page.url):
+                    raise SessionExpired()
+                print("Waiting for My Unit Tasks button in sidebar...", flush=True)
+                my_unit_tasks_button = await page.wait_for_selector('xpath=//*[@id="app_container"]/app-main-layout/div/div[2]/app-board-view/div/div[1]/div[4]/div[3]/a[2]', timeout=15000)
+                print("My Unit Tasks button found. Clicking...", flush=True)
+                async with page.expect_navigation(timeout=20000):
+                    await my_unit_tasks_button.click()
+                print("My Unit Tasks button clicked. Waiting for columns to appear...", flush=True)
+                await page.wait_for_selector('.board-col', timeout=15000)
+                print("Columns appeared. Waiting for content to load...", flush=True)
+                # An empty board is indistinguishable from one still filling; saving
+                # it would wipe the user's tasks, so no cards means a failed attempt
+                if not await readiness.wait_board_ready(page, min_count=1):
+                    raise RuntimeError("Board cards did not load")
+                return "ok"
+            except SessionExpired:
+                raise
+            except Exception as e:
+                if session_cache.is_sso_url(page.url):
+                    raise SessionExpired()
+                try:
+                    content = await page.content()
+                except Exception:
+                    content = ""
+                if "403" in content or "permission" in content.lower():
+                    print(f"403 Permission error detected on attempt {attempt+1}. Retrying after backoff...", flush=True)
+                    return "forbidden"
+                else:
+                    print(f"Failed to show columns after Halasat button click: {e}", flush=True)
+                try:
+                    await page.screenshot(path=os.path.join(ERRORS_DIR, f"error_no_columns_attempt{attempt+1}.png"))
+                    print(f"Screenshot saved as Errors/error_no_columns_attempt{attempt+1}.png", flush=True)
+                except:
+                    pass
+                backoff = 2 ** attempt
+                print(f"Waiting {backoff} seconds before retrying...", flush=True)
+                await asyncio.sleep(backoff)
+                if attempt == max_retries - 1:
+                    print("Max retries reached. Aborting scrape.", flush=True)
+                    return "failed"
+        return "failed"
+
+    async def _scrape_card_messages(self, page, card_el, case_number, uuid):
+        """Notes from the card's modal, or None when they could not be read."""
+        # Between modals is a safe point to let waiting interactive work run
+        await scheduler.checkpoint_async()
+        messages = []
+        failed = False
+        try:
+            notes_btn_xpath = 'xpath=.//div[contains(@class,\"action-buttons\")]/a[@tooltip=\"Notes\"]'
+            msg_btn = await card_el.query_selector(notes_btn_xpath)
+            if not msg_btn:
+                action_btns = await card_el.query_selector_all('div.action-buttons a')
+                if len(action_btns) >= 2:
+                    msg_btn = action_btns[1]
+            if msg_btn:
+                try:
+                    modal_open = await page.query_selector('.notes-modal-messages-container')
+                    if modal_open:
+                        print(f"Previous notes modal detected, closing before next click.", flush=True)
+                        close_btn = await page.query_selector('.notes-modal-header .close-icon, xpath=/html/body/modal-container/div[2]/div/app-modal-notes/div[1]/button')
+                        if close_btn:
+                            await close_btn.click()
+                            await page.wait_for_selector('.notes-modal-messages-container', state='detached', timeout=5000)
+                except Exception as e:
+                    print(f"Error closing previous notes modal: {e}", flush=True)
+                print(f"Clicking Notes button for card {case_number}", flush=True)
+                await msg_btn.click()
+                try:
+                    await page.wait_for_selector('.notes-modal-messages-container', timeout=10000)
+                    await readiness.wait_stable_count(page, "notes.messages", '.notes-modal-messages-container .notes-modal-message', timeout=5000)
+                    msg_container = await page.query_selector('.notes-modal-messages-container')
+                    msg_elems = await msg_container.query_selector_all('.notes-modal-message') if msg_container else []
+                    print(f"Found {len(msg_elems)} messages in popup for card {case_number}", flush=True)
+                    for msg_el in msg_elems:
+                        content_el = await msg_el.query_selector('.message-content')
+                        text = await content_el.inner_text() if content_el else ""
+                        sender_el = await msg_el.query_selector('.message-sender, .highlight')
+                        sender = await sender_el.inner_text() if sender_el else ""
+                        time_el = await msg_el.query_selector('.message-time')
+                        time = await time_el.inner_text() if time_el else ""
+                        extra_text_el = await msg_el.query_selector('.message-text')
+                        extra_text = await extra_text_el.inner_text() if extra_text_el else ""
+                        full_message = f"{text} {extra_text}".strip()
+                        messages.append({
+                            "sender": sender,
+                            "message": full_message,
+                            "date": time
+                        })
+                    if len(msg_elems) == 0:
+                        popup_html = await msg_container.inner_html() if msg_container else ""
+                        print(f"Popup HTML for card {case_number}:\n{popup_html}\n---", flush=True)
+                except Exception as e:
+                    failed = True
+                    print(f"Error waiting for message popup for card {case_number}: {e}", flush=True)
+                try:
+                    close_btn = await page.query_selector('xpath=/html/body/modal-container/div[2]/div/app-modal-notes/div[1]/span/i-feather')
+                    if close_btn:
+                        await close_btn.click()
+                        await readiness.wait_detached(page, "notes.close", '.notes-modal-messages-container', timeout=5000)
+                        print(f"Closed notes popup for card {case_number}", flush=True)
+                    else:
+                        print(f"Close button not found for message popup of card {case_number}", flush=True)
+                except Exception as e:
+                    print(f"Error closing notes popup for card {case_number}: {e}", flush=True)
+            else:
+                failed = True
+                print(f"Notes button not found for card {case_number}", flush=True)
+        except Exception as e:
+            failed = True
+            print(f"Error scraping messages for card {case_number}: {e}", flush=True)
+            try:
+                await page.screenshot(path=os.path.join(ERRORS_DIR, f"error_scraping_messages_{uuid or 'unknown'}.png"))
+                print(f"Screenshot saved for message error on card {uuid or 'unknown'}.", flush=True)
+            except:
+                pass
+        return None if failed else messages
+
+    async def _fetch_notes_via_api(self, cards, token):
+        if SCRAPER_NOTES_SOURCE != "api" or not token:
+            return {}
+        uuids = [c["uuid"] for c in cards if c.get("uuid")]
+        if not uuids:
+            return {}
+        started = time.monotonic()
+        notes = await asyncio.to_thread(fms_api.fetch_notes_bulk, uuids, token)
+        fetched = sum(1 for m in notes.values() if m is not None)
+        print(f"Fetched notes for {fetched}/{len(uuids)} cards via API in {time.monotonic() - started:.1f}s", flush=True)
+        return notes
+
+    def _make_emitter(self, username, on_record):
+        """Wrap on_record so a failing consumer never breaks the scrape."""
+        def emit(record_type, **fields):
+            if not on_record:
+                return
+            record = {"type": record_type, "username": username, "ts": time.time()}
+            record.update(fields)
+            try:
+                on_record(record)
+            except Exception as e:
+                print(f"[Records] Consumer failed on {record_type} record for {username}: {e}", flush=True)
+        return emit
+
+    async def _scrape_columns(self, page, username, token=None, emit=None):
+        print("Scraping columns...", flush=True)
+        await page.wait_for_selector('.board-col', timeout=120000)
+        if SCRAPER_EXTRACT_MODE == "dom":
+            return await self._scrape_columns_dom(page, emit)
+        board = await page.evaluate(BOARD_EXTRACT_JS, BOARD_COLUMNS)
+        print(f"Detected column titles: {board['titles']}", flush=True)
+        for col_title in BOARD_COLUMNS:
+            if col_title not in board['titles']:
+                print(f"Column {col_title} not found.", flush=True)
+        print(f"Extracted {len(board['cards'])} cards in one pass", flush=True)
+        # File I/O goes to a worker thread: under asgi_app this loop also serves requests
+        index = await asyncio.to_thread(FingerprintIndex, username)
+        full_refresh = index.needs_full_refresh()
+        cached = {}
+        deep_cards = []
+        for card in board['cards']:
+            card['fp'] = card_fingerprint(card['Column'], card['CardText'], card.pop('noteHint', ''))
+            messages = None if full_refresh else index.cached_messages(card['uuid'], card['fp'])
+            if messages is None:
+                deep_cards.append(card)
+            else:
+                cached[card['uuid']] = messages
+        print(f"{'Full refresh' if full_refresh else 'Incremental scrape'}: {len(deep_cards)} new/changed card(s), {len(cached)} unchanged", flush=True)
+        await scheduler.checkpoint_async()
+        api_notes = await self._fetch_notes_via_api(deep_cards, token)
+        csv_data = []
+        fingerprints = []
+        unread = set()
+        for card in board['cards']:
+            col_index = card.pop('colIndex')
+            card_index = card.pop('cardIndex')
+            fingerprint = card.pop('fp')
+            meta = card
+            fingerprints.append(fingerprint)
+            if meta["uuid"] in cached:
+                meta["messages"] = cached[meta["uuid"]]
+                csv_data.append(meta)
+                emit("card", card=dict(meta))
+                continue
+            if api_notes.get(meta["uuid"]) is not None:
+                meta["messages"] = api_notes[meta["uuid"]]
+                csv_data.append(meta)
+                emit("card", card=dict(meta))
+                continue
+            card_el = await self._card_handle(page, meta, col_index, card_index)
+            messages = None
+            if card_el:
+                messages = await self._scrape_card_messages(page, card_el, meta["CaseNumber"], meta["uuid"])
+            else:
+                print(f"Card {meta['CaseNumber']} disappeared before its notes could be read", flush=True)
+            if messages is None:
+                # Keep the notes we had instead of wiping them; the card is re-read next cycle
+                unread.add(meta["uuid"])
+                messages = index.previous_messages(meta["uuid"])
+            meta["messages"] = messages
+            csv_data.append(meta)
+            emit("card", card=dict(meta))
+        index.update([
+            {"uuid": meta["uuid"], "fp": fp, "messages": None if meta["uuid"] in unread else meta["messages"]}
+            for meta, fp in zip(csv_data, fingerprints)
+        ], full_refresh)
         try:
-            print("Starting Playwright...", flush=True)
-            async with async_playwright() as p:
-                print(f"Creating new session for user: {username}", flush=True)
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context()
-                await context.clear_cookies()
+            await asyncio.to_thread(index.save)
+        except Exception as e:
+            print(f"[Fingerprint] Failed to save index for {username}: {e}", flush=True)
+        return csv_data
+
+    async def _card_handle(self, page, meta, col_index, card_index):
+        """The board-task-box for a card from the one-pass extract, or None if it is gone.
+
+        The board may have re-rendered since the extract, so the handle is found
+        by uuid; cards without one fall back to their position, checked against
+        the case number.
+        """
+        if meta["uuid"]:
+            return await page.query_selector(
+                f'.board-col board-task-box:has(a[tooltip="View task in new tab"][href*="/task/{meta["uuid"]}"])')
+        columns = await page.query_selector_all('.board-col')
+        handles = await columns[col_index].query_selector_all('board-task-box') if col_index < len(columns) else []
+        card_el = handles[card_index] if card_index < len(handles) else None
+        if card_el:
+            code_el = await card_el.query_selector('.task-code')
+            if not code_el or (await code_el.inner_text()).strip() != meta["CaseNumber"].strip():
+                return None
+        return card_el
+
+    async def _scrape_columns_dom(self, page, emit):
+        csv_data = []
+        columns = await page.query_selector_all('.board-col')
+        detected_titles = []
+        for c in columns:
+            col_title_el = await c.query_selector('.board-col-title h5')
+            title = await col_title_el.inner_text() if col_title_el else ""
+            detected_titles.append(title)
+        print(f"Detected column titles: {detected_titles}", flush=True)
+
+        for col_title in BOARD_COLUMNS:
+            print(f"Processing column: {col_title}", flush=True)
+            col = None
+            for c, title in zip(columns, detected_titles):
+                if title == col_title:
+                    col = c
+                    break
+            if not col:
+                print(f"Column {col_title} not found.")
+                continue
+            card_els = await col.query_selector_all('board-task-box')
+            print(f"Found {len(card_els)} cards in column {col_title}", flush=True)
+            for idx, card_el in enumerate(card_els):
+                print(f"--- Processing card {idx+1}/{len(card_els)} in column '{col_title}' ---", flush=True)
+                card_html = await card_el.inner_html()
+                print(f"Card HTML for debugging:\n{card_html}\n---", flush=True)
+                case_number_el = await card_el.query_selector('.task-code')
+                case_number = await case_number_el.inner_text() if case_number_el else ""
+                title_el = await card_el.query_selector('.task-name a')
+                card_title = await title_el.inner_text() if title_el else ""
+                fbg_el = await card_el.query_selector('.task-info[title^=\"FBG\"]')
+                fbg_number = await fbg_el.inner_text() if fbg_el else ""
+                if not fbg_number:
+                    infos = await card_el.query_selector_all('.task-info')
+                    if len(infos) >= 1:
+                        for info in infos:
+                            txt = await info.inner_text()
+                            if txt.strip().startswith("FBG"):
+                                fbg_number = txt.strip()
+                                break
+                card_text = await card_el.inner_text()
+                uuid = None
+                view_tab_link = await card_el.query_selector('.action-buttons a[tooltip=\"View task in new tab\"][target=\"_blank\"]')
+                card_url = None
+                if view_tab_link:
+                    href = await view_tab_link.get_attribute('href')
+                    print(f"Extracted href for card {case_number}: {href}", flush=True)
+                    if href and '/task/' in href:
+                        uuid = href.split('/task/')[-1]
+                        card_url = f"https://msp.go2field.iq/task/{uuid}"
+                meta = {
+                    "Column": col_title,
+                    "CaseNumber": case_number,
+                    "Title": card_title,
+                    "FBG": fbg_number,
+                    "CardText": card_text,
+                    "uuid": uuid
+                }
+                meta["messages"] = await self._scrape_card_messages(page, card_el, case_number, uuid) or []
+                csv_data.append(meta)
+                emit("card", card=dict(meta))
+        return csv_data
+
+    def _save_csv(self, username, csv_data):
+        import csv
+        from datetime import datetime
+        os.makedirs(SCRAPED_RESULTS_DIR, exist_ok=True)
+        dt_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        csv_path = os.path.join(SCRAPED_RESULTS_DIR, f"scraped_{username}_{dt_str}.csv")
+        try:
+            with open(csv_path, "w", newline='', encoding=get_platform_encoding()) as f:
+                fieldnames = ["Column", "CaseNumber", "Title", "FBG", "CardText", "uuid", "messages"]
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                for row in csv_data:
+                    row = row.copy()
+                    row["messages"] = json.dumps(row["messages"], ensure_ascii=False)
+                    writer.writerow(row)
+            print(f"Saved scraped data to {csv_path}", flush=True)
+        except Exception as file_err:
+            print(f"[ERROR] Failed to write CSV: {file_err}", flush=True)
+            import traceback
+            traceback.print_exc()
+
+    def _save_token_file(self, token):
+        token_path = os.path.join(BASE_DIR, "token.json")
+        with open(token_path, "w") as f:
+            json.dump({"token": token}, f)
+        print(f"Token saved to {token_path}", flush=True)
+
+    async def _extract_token(self, page, context, username=None):
+        print("Extracting token for API use...", flush=True)
+        ss_dump = await page.evaluate('''() => {
+            let out = [];
+            for (let k in window.sessionStorage) {
+                out.push({key: k, value: String(window.sessionStorage[k])});
+            }
+            return out;
+        }''')
+        token = None
+        for entry in ss_dump:
+            if entry['key'] == 'formauthtoken' and entry['value'].startswith('eyJ'):
+                token = entry['value']
+                print('Token found in sessionStorage["formauthtoken"]', flush=True)
+                break
+        if not token:
+            cookies = await context.cookies()
+            for cookie in cookies:
+                if cookie['name'] == '__auth_token__' and cookie['value'].startswith('eyJ'):
+                    token = cookie['value']
+                    print('Token found in __auth_token__ cookie', flush=True)
+                    break
+        if not token:
+            for cookie in cookies:
+                if cookie['name'] == 'KEYCLOAK_IDENTITY' and cookie['value'].startswith('eyJ'):
+                    token = cookie['value']
+                    print('Token found in KEYCLOAK_IDENTITY cookie', flush=True)
+                    break
+        if token:
+            await asyncio.to_thread(self._save_token_file, token)
+            token_manager.put(username, token)
+        else:
+            print("Failed to retrieve token.", flush=True)
+        return token
+
+    async def verify_login(self, username, password):
+        """Check credentials with an SSO login in a throwaway context, without touching the board.
+
+        Returns False when SSO rejects them; other failures raise. On success the
+        new session is cached so the next scrape of username skips SSO.
+        """
+        async with scheduler.slot_async("login_verify", username, INTERACTIVE), self.browser_in_use():
+            browser = await self.ensure_browser()
+            context = await browser.new_context(user_agent=USER_AGENT, viewport={"width": 1280, "height": 800})
+            try:
                 page = await context.new_page()
-                await page.set_extra_http_headers({
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-                    "Accept-Language": "en-US,en;q=0.9"
-                })
-                await page.set_viewport_size({"width": 1280, "height": 800})
-                print("Navigating to login page...", flush=True)
-                await page.goto(LOGIN_URL)
-                print("Filling username...", flush=True)
-                await page.fill('//*[@id="username"]', username)
-                print("Filling password...", flush=True)
-                await page.fill('//*[@id="password"]', password)
-                print("Clicking sign in...", flush=True)
-                await page.click('//*[@id="kc-form-buttons"]')
-                print("Waiting for OTP/password page...", flush=True)
-                await page.wait_for_url("**/login-actions/authenticate?*", timeout=30000)
-                print("Filling OTP/password again...", flush=True)
-                await page.fill('//*[@id="pi_otp"]', password)
-                print("Clicking confirm...", flush=True)
-                await page.click('//*[@id="kc-login"]')
-                print("Waiting for page to load after confirm...", flush=True)
-                await asyncio.sleep(5)
-                print("Login and initial navigation complete.", flush=True)
-
-                max_retries = 4
-                for attempt in range(max_retries):
+                await resource_policy.apply_async(context, page, "scrape")
+                try:
+                    await self._login(page, username, password)
+                except Exception:
+                    if session_cache.is_sso_url(page.url) and await page.query_selector('#username, #pi_otp'):
+                        print(f"[Login] SSO rejected credentials for {username}.", flush=True)
+                        return False
+                    raise
+                if session_cache.is_sso_url(page.url):
+                    return False
+                await asyncio.to_thread(session_cache.save_state, username, await context.storage_state())
+                session = self.sessions.get(username)
+                if session and not session["lock"].locked():
+                    # Drop the pooled context so the next scrape starts from the verified session
+                    await self.close_session(username)
+                return True
+            finally:
+                await context.close()
+
+    async def refresh_token(self, username, password):
+        """Fetch a fresh API token for username without scraping the board.
+
+        Reloads the board in the user's pooled context so the SPA re-issues
+        formauthtoken, logging in again only when the session went to SSO.
+        """
+        async with scheduler.slot_async("token_refresh", username, TOKEN), self.browser_in_use():
+            session = await self.get_session(username)
+            async with session["lock"]:
+                page = session["page"]
+                context = session["context"]
+                try:
+                    if not session["authenticated"]:
+                        await self._login(page, username, password)
+                        session["authenticated"] = True
                     try:
-                        await page.goto("https://msp.go2field.iq/board/a22c39cb-093c-d83e-7dd1-a8c7a5d0fa7b", wait_until="domcontentloaded", timeout=90000)
-                        await asyncio.sleep(2)
-                        print("Waiting for My Unit Tasks button in sidebar...", flush=True)
-                        my_unit_tasks_button = await page.wait_for_selector('xpath=//*[@id="app_container"]/app-main-layout/div/div[2]/app-board-view/div/div[1]/div[4]/div[3]/a[2]', timeout=15000)
-                        print("My Unit Tasks button found. Clicking...", flush=True)
-                        async with page.expect_navigation(timeout=20000):
-                            await my_unit_tasks_button.click()
-                        print("My Unit Tasks button clicked. Waiting for columns to appear...", flush=True)
-                        await page.wait_for_selector('.board-col', timeout=15000)
-                        print("Columns appeared. Waiting for content to load...", flush=True)
-                        await asyncio.sleep(7)
-                        break
+                        # Drop the old token so the reload can't hand it straight back
+                        await page.evaluate("() => window.sessionStorage.removeItem('formauthtoken')")
+                    except Exception:
+                        pass
+                    await page.goto(BOARD_URL, wait_until="domcontentloaded", timeout=60000)
+                    if session_cache.is_sso_url(page.url):
+                        print(f"[Token] Session for {username} expired, logging in again...", flush=True)
+                        await asyncio.to_thread(session_cache.invalidate, username)
+                        await self._login(page, username, password)
+                        await page.goto(BOARD_URL, wait_until="domcontentloaded", timeout=60000)
+                    await readiness.wait_api_idle(page, "token.refresh")
+                    token = await self._extract_token(page, context, username)
+                    if token:
+                        await asyncio.to_thread(session_cache.save_state, username, await context.storage_state(), token)
+                    return token
+                except Exception as e:
+                    print(f"[Token] Refresh for {username} failed: {e}", flush=True)
+                    await self.close_session(username)
+                    return None
+
+    def _record_result(self, username, status, started, cards=0, error=None, emit=None):
+        if emit:
+            emit("run_finished", status=status, cards=cards, error=error)
+        self.last_results[username] = {
+            "status": status,
+            "error": error,
+            "cards": cards,
+            "duration": round(time.monotonic() - started, 2),
+            "finished_at": time.time(),
+        }
+
+    async def scrape_with_session(self, username, password, on_record=None):
+        """Scrape username's board; card records stream to on_record as they are read."""
+        print("\n--- Scraper run started ---", flush=True)
+        started = time.monotonic()
+        started_at = time.time()
+        emit = self._make_emitter(username, on_record)
+        os.makedirs(ERRORS_DIR, exist_ok=True)
+        async with self.browser_in_use():
+            try:
+                session = await self.get_session(username)
+            except Exception as e:
+                print(f"Exception in scrape_with_session: {e}", flush=True)
+                self._record_result(username, "failed", started, error=str(e), emit=emit)
+                return []
+            async with session["lock"]:
+                self.browser_uses += 1
+                session["uses"] += 1
+                emit("run_started")
+                page = session["page"]
+                context = session["context"]
+                try:
+                    if not session["authenticated"]:
+                        await self._login(page, username, password)
+                        session["authenticated"] = True
+                    # Safe points between stages let waiting interactive work take the slot
+                    await scheduler.checkpoint_async()
+                    try:
+                        board_status = await self._open_board(page)
+                    except SessionExpired:
+                        print("Board redirected to SSO, cached session no longer valid. Logging in again...", flush=True)
+                        await asyncio.to_thread(session_cache.invalidate, username)
+                        await self._login(page, username, password)
+                        board_status = await self._open_board(page)
+                    if board_status != "ok":
+                        self._record_result(username, board_status, started, emit=emit)
+                        return []
+                    await scheduler.checkpoint_async()
+                    # Token first: the notes stage calls the FMS API with it
+                    token = await self._extract_token(page, context, username)
+                    csv_data = []
+                    status, error = "ok", None
+                    try:
+                        csv_data = await self._scrape_columns(page, username, token, emit)
+                        run_id = await asyncio.to_thread(task_store.save_scrape, username, csv_data, started_at=started_at)
+                        print(f"Saved {len(csv_data)} tasks to task store (run {run_id})", flush=True)
+                        if token:
+                            # Warm task forms (and their compiled templates) before anyone opens them
+                            queued = form_cache.prefetch([row["uuid"] for row in csv_data if row.get("uuid")], token,
+                                                         on_form=compiled_forms.for_form)
+                            print(f"Queued {queued} task form(s) for prefetch", flush=True)
+                        if SCRAPER_WRITE_CSV:
+                            await asyncio.to_thread(self._save_csv, username, csv_data)
                     except Exception as e:
+                        status, error = "failed", str(e)
+                        print(f"Error scraping columns: {e}", flush=True)
                         try:
-                            content = await page.content()
+                            await page.screenshot(path=os.path.join(ERRORS_DIR, "error_scraping_columns.png"))
+                            print("Screenshot saved as Errors/error_scraping_columns.png", flush=True)
                         except Exception:
-                            content = ""
-                        if "403" in content or "permission" in content.lower():
-                            print(f"403 Permission error detected on attempt {attempt+1}. Retrying after backoff...", flush=True)
-                            return []
-                        else:
-                            print(f"Failed to show columns after Halasat button click: {e}", flush=True)
-                        try:
-                            await page.screenshot(path=f"Errors/error_no_columns_attempt{attempt+1}.png")
-                            print(f"Screenshot saved as Errors/error_no_columns_attempt{attempt+1}.png", flush=True)
-                        except:
                             pass
-                        backoff = 2 ** attempt
-                        print(f"Waiting {backoff} seconds before retrying...", flush=True)
-                        await asyncio.sleep(backoff)
-                        if attempt == max_retries - 1:
-                            print("Max retries reached. Aborting scrape.", flush=True)
-                            return []
-                print("Scraping columns...", flush=True)
-                csv_data = []
-                try:
-                    await page.wait_for_selector('.board-col', timeout=120000)
-                    columns = await page.query_selector_all('.board-col')
-                    detected_titles = []
-                    for c in columns:
-                        col_title_el = await c.query_selector('.board-col-title h5')
-                        title = await col_title_el.inner_text() if col_title_el else ""
-                        detected_titles.append(title)
-                    print(f"Detected column titles: {detected_titles}", flush=True)
-
-                    for col_title in ["New", "Pending", "In Progress"]:
-                        print(f"Processing column: {col_title}", flush=True)
-                        col = None
-                        for c in columns:
-                            col_title_el = await c.query_selector('.board-col-title h5')
-                            title = await col_title_el.inner_text() if col_title_el else ""
-                            if title == col_title:
-                                col = c
-                                break
-                        if not col:
-                            print(f"Column {col_title} not found.")
-                            continue
-                        card_els = await col.query_selector_all('board-task-box')
-                        print(f"Found {len(card_els)} cards in column {col_title}", flush=True)
-                        for idx, card_el in enumerate(card_els):
-                            print(f"--- Processing card {idx+1}/{len(card_els)} in column '{col_title}' ---", flush=True)
-                            card_html = await card_el.inner_html()
-                            print(f"Card HTML for debugging:\n{card_html}\n---", flush=True)
-                            case_number_el = await card_el.query_selector('.task-code')
-                            case_number = await case_number_el.inner_text() if case_number_el else ""
-                            title_el = await card_el.query_selector('.task-name a')
-                            card_title = await title_el.inner_text() if title_el else ""
-                            fbg_el = await card_el.query_selector('.task-info[title^=\"FBG\"]')
-                            fbg_number = await fbg_el.inner_text() if fbg_el else ""
-                            if not fbg_number:
-                                infos = await card_el.query_selector_all('.task-info')
-                                if len(infos) >= 1:
-                                    for info in infos:
-                                        txt = await info.inner_text()
-                                        if txt.strip().startswith("FBG"):
-                                            fbg_number = txt.strip()
-                                            break
-                            card_text = await card_el.inner_text()
-                            uuid = None
-                            view_tab_link = await card_el.query_selector('.action-buttons a[tooltip=\"View task in new tab\"][target=\"_blank\"]')
-                            card_url = None
-                            if view_tab_link:
-                                href = await view_tab_link.get_attribute('href')
-                                print(f"Extracted href for card {case_number}: {href}", flush=True)
-                                if href and '/task/' in href:
-                                    uuid = href.split('/task/')[-1]
-                                    card_url = f"https://msp.go2field.iq/task/{uuid}"
-                            meta = {
-                                "Column": col_title,
-                                "CaseNumber": case_number,
-                                "Title": card_title,
-                                "FBG": fbg_number,
-                                "CardText": card_text,
-                                "uuid": uuid
-                            }
-                            messages = []
-                            try:
-                                notes_btn_xpath = 'xpath=.//div[contains(@class,\"action-buttons\")]/a[@tooltip=\"Notes\"]'
-                                msg_btn = await card_el.query_selector(notes_btn_xpath)
-                                if not msg_btn:
-                                    action_btns = await card_el.query_selector_all('div.action-buttons a')
-                                    if len(action_btns) >= 2:
-                                        msg_btn = action_btns[1]
-                                if msg_btn:
-                                    try:
-                                        modal_open = await page.query_selector('.notes-modal-messages-container')
-                                        if modal_open:
-                                            print(f"Previous notes modal detected, closing before next click.", flush=True)
-                                            close_btn = await page.query_selector('.notes-modal-header .close-icon, xpath=/html/body/modal-container/div[2]/div/app-modal-notes/div[1]/button')
-                                            if close_btn:
-                                                await close_btn.click()
-                                                await asyncio.sleep(0.5)
-                                                await page.wait_for_selector('.notes-modal-messages-container', state='detached', timeout=5000)
-                                    except Exception as e:
-                                        print(f"Error closing previous notes modal: {e}", flush=True)
-                                    print(f"Clicking Notes button for card {case_number}", flush=True)
-                                    await msg_btn.click()
-                                    await asyncio.sleep(1)
-                                    try:
-                                        await page.wait_for_selector('.notes-modal-messages-container', timeout=10000)
-                                        msg_container = await page.query_selector('.notes-modal-messages-container')
-                                        msg_elems = await msg_container.query_selector_all('.notes-modal-message') if msg_container else []
-                                        print(f"Found {len(msg_elems)} messages in popup for card {case_number}", flush=True)
-                                        for msg_el in msg_elems:
-                                            content_el = await msg_el.query_selector('.message-content')
-                                            text = await content_el.inner_text() if content_el else ""
-                                            sender_el = await msg_el.query_selector('.message-sender, .highlight')
-                                            sender = await sender_el.inner_text() if sender_el else ""
-                                            time_el = await msg_el.query_selector('.message-time')
-                                            time = await time_el.inner_text() if time_el else ""
-                                            extra_text_el = await msg_el.query_selector('.message-text')
-                                            extra_text = await extra_text_el.inner_text() if extra_text_el else ""
-                                            full_message = f"{text} {extra_text}".strip()
-                                            messages.append({
-                                                "sender": sender,
-                                                "message": full_message,
-                                                "date": time
-                                            })
-                                        if len(msg_elems) == 0:
-                                            popup_html = await msg_container.inner_html() if msg_container else ""
-                                            print(f"Popup HTML for card {case_number}:\n{popup_html}\n---", flush=True)
-                                    except Exception as e:
-                                        print(f"Error waiting for message popup for card {case_number}: {e}", flush=True)
-                                    try:
-                                        close_btn = await page.query_selector('xpath=/html/body/modal-container/div[2]/div/app-modal-notes/div[1]/span/i-feather')
-                                        if close_btn:
-                                            await close_btn.click()
-                                            await asyncio.sleep(0.5)
-                                            print(f"Closed notes popup for card {case_number}", flush=True)
-                                        else:
-                                            print(f"Close button not found for message popup of card {case_number}", flush=True)
-                                    except Exception as e:
-                                        print(f"Error closing notes popup for card {case_number}: {e}", flush=True)
-                                else:
-                                    print(f"Notes button not found for card {case_number}", flush=True)
-                            except Exception as e:
-                                print(f"Error scraping messages for card {case_number}: {e}", flush=True)
-                                try:
-                                    await page.screenshot(path=f"Errors/error_scraping_messages_{uuid or 'unknown'}.png")
-                                    print(f"Screenshot saved for message error on card {uuid or 'unknown'}.", flush=True)
-                                except:
-                                    pass
-                            meta["messages"] = messages
-                            csv_data.append(meta)
-
-                    # Save CSV after scraping
-                    import csv
-                    from datetime import datetime
-                    folder = "scraped_results"
-                    os.makedirs(folder, exist_ok=True)
-                    dt_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                    csv_path = os.path.join(folder, f"scraped_{dt_str}.csv")
+
                     try:
-                        with open(csv_path, "w", newline='', encoding=get_platform_encoding()) as f:
-                            fieldnames = ["Column", "CaseNumber", "Title", "FBG", "CardText", "uuid", "messages"]
-                            writer = csv.DictWriter(f, fieldnames=fieldnames)
-                            writer.writeheader()
-                            for row in csv_data:
-                                row = row.copy()
-                                row["messages"] = json.dumps(row["messages"], ensure_ascii=False)
-                                writer.writerow(row)
-                        print(f"Saved scraped data to {csv_path}", flush=True)
-                    except Exception as file_err:
-                        print(f"[ERROR] Failed to write CSV: {file_err}", flush=True)
-                        import traceback
-                        traceback.print_exc()
+                        await asyncio.to_thread(session_cache.save_state, username, await context.storage_state(), token)
+                    except Exception as e:
+                        print(f"[Session] Failed to save session for {username}: {e}", flush=True)
+                    self._record_result(username, status, started, cards=len(csv_data), error=error, emit=emit)
+                    return csv_data
                 except Exception as e:
-                    print(f"Error scraping columns: {e}", flush=True)
-                    try:
-                        await page.screenshot(path="Errors/error_scraping_columns.png")
-                        print("Screenshot saved as Errors/error_scraping_columns.png", flush=True)
-                    except Exception:
-                        pass
+                    print(f"Exception in scrape_with_session: {e}", flush=True)
+                    self._record_result(username, "failed", started, error=str(e), emit=emit)
+                    # A half-logged-in or crashed page is not worth reusing.
+                    await self.close_session(username)
+                    return []
 
-                # --- TOKEN EXTRACTION LOGIC (always runs after scrape) ---
-                print("Extracting token for API use...", flush=True)
-                ss_dump = await page.evaluate('''() => {
-                    let out = [];
-                    for (let k in window.sessionStorage) {
-                        out.push({key: k, value: String(window.sessionStorage[k])});
-                    }
-                    return out;
-                }''')
-                token = None
-                for entry in ss_dump:
-                    if entry['key'] == 'formauthtoken' and entry['value'].startswith('eyJ'):
-                        token = entry['value']
-                        print('Token found in sessionStorage["formauthtoken"]', flush=True)
-                        break
-                if not token:
-                    cookies = await context.cookies()
-                    for cookie in cookies:
-                        if cookie['name'] == '__auth_token__' and cookie['value'].startswith('eyJ'):
-                            token = cookie['value']
-                            print('Token found in __auth_token__ cookie', flush=True)
-                            break
-                if not token:
-                    for cookie in cookies:
-                        if cookie['name'] == 'KEYCLOAK_IDENTITY' and cookie['value'].startswith('eyJ'):
-                            token = cookie['value']
-                            print('Token found in KEYCLOAK_IDENTITY cookie', flush=True)
-                            break
-                if token:
-                    token_data = {"token": token}
-                    token_path = os.path.join(os.path.dirname(__file__), "token.json")
-                    with open(token_path, "w") as f:
-                        json.dump(token_data, f)
-                    print(f"Token saved to {token_path}", flush=True)
-                else:
-                    print("Failed to retrieve token.", flush=True)
+scraper_manager = ScraperSessionManager()
+
+async def scrape(username, password, on_record=None):
+    return await scraper_manager.scrape_with_session(username, password, on_record)
+
+async def scrape_all(users, concurrency=SCRAPE_CONCURRENCY, retries=SCRAPE_USER_RETRIES, should_stop=None, on_record=None):
+    """Scrape every user concurrently on the shared browser, at most `concurrency` at a time.
+
+    Each user gets its own context and retry budget, so one user's failure never
+    blocks or aborts the others. Every user's scrape also takes a background slot
+    from the browser scheduler, so interactive work goes first. Returns
+    {username: result} with per-user timing.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    results = {}
 
+    async def scrape_user(user):
+        username = user['username']
+        async with semaphore, scheduler.slot_async("background_scrape", username, BACKGROUND):
+            if should_stop and should_stop():
+                print(f"[Cycle] Stop requested, skipping {username}.", flush=True)
+                results[username] = {"status": "skipped", "attempts": 0, "duration": 0}
+                return
+            started = time.monotonic()
+            attempt = 0
+            while True:
+                attempt += 1
                 try:
-                    await browser.close()
-                    print(f"Closed browser for {username} after scraping.", flush=True)
+                    await scrape(username, user['password'], on_record)
+                    result = dict(scraper_manager.last_results.get(username, {"status": "failed"}))
                 except Exception as e:
-                    print(f"Error closing browser for {username}: {e}", flush=True)
-                return csv_data
-        except Exception as e:
-            print(f"Exception in scrape_with_session: {e}", flush=True)
-            return []
+                    result = {"status": "failed", "error": str(e)}
+                # 403s are not transient, don't hammer the board retrying them
+                if result["status"] in ("ok", "forbidden") or attempt > retries:
+                    break
+                print(f"[Cycle] Scrape for {username} {result['status']} (attempt {attempt}), retrying...", flush=True)
+            result["attempts"] = attempt
+            result["duration"] = round(time.monotonic() - started, 2)
+            results[username] = result
+            print(f"[Cycle] {username}: {result['status']} in {result['duration']}s ({attempt} attempt(s), {result.get('cards', 0)} cards)", flush=True)
 
-scraper_manager = ScraperSessionManager()
+    cycle_started = time.monotonic()
+    await asyncio.gather(*(scrape_user(u) for u in users))
+    print(f"[Cycle] Scraped {len(users)} user(s) in {time.monotonic() - cycle_started:.1f}s (concurrency {concurrency}).", flush=True)
+    return results
+
+def ndjson_record_writer(stream):
+    """on_record consumer writing newline-delimited JSON records to stream."""
+    def write(record):
+        stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        stream.flush()
+    return write
 
-async def scrape(username, password):
-    return await scraper_manager.scrape_with_session(username, password)
+async def scrape_periodically(username, password, interval=None, on_record=None):
+    """Scrape username forever; a fixed interval, or adaptive timing from ScrapePlanner."""
+    # Someone started this loop, so treat the user as recently active
+    planner = ScrapePlanner(baseline="recent")
+    previous = None
+    try:
+        while True:
+            try:
+                rows = await scrape(username, password, on_record)
+                status = scraper_manager.last_results.get(username, {}).get("status", "failed")
+                snapshot = json.dumps(rows, sort_keys=True, ensure_ascii=False)
+                planner.record(username, status, changed=snapshot != previous)
+                if status == "ok":
+                    previous = snapshot
+            except Exception as e:
+                print(f"Error in periodic scrape: {e}", flush=True)
+                planner.record(username, "failed", changed=False)
+            wait = interval if interval is not None else planner.seconds_until_next([username])
+            print(f"Waiting {wait:.0f} seconds before next scrape...", flush=True)
+            await asyncio.sleep(wait)
+    finally:
+        await scraper_manager.shutdown()
 
 if __name__ == "__main__":
-    import asyncio
+    args = sys.argv[1:]
+    # --records-fd N: stream card records as NDJSON on an inherited fd, keeping
+    # stdout free for the human-readable log
+    records_stream = None
+    if "--records-fd" in args:
+        i = args.index("--records-fd")
+        records_stream = os.fdopen(int(args[i + 1]), "w", buffering=1, encoding="utf-8")
+        del args[i:i + 2]
     username = os.environ.get("SCRAPER_USERNAME")
     password = os.environ.get("SCRAPER_PASSWORD")
-    if len(sys.argv) >= 3:
-        username = sys.argv[1]
-        password = sys.argv[2]
+    if len(args) >= 2:
+        username = args[0]
+        password = args[1]
     if not username or not password:
-        print("Usage: python scraper.py <username> <password>", flush=True)
+        print("Usage: python scraper.py <username> <password> [--records-fd N]", flush=True)
         sys.exit(1)
     print(f"Starting periodic scrape for user: {username}", flush=True)
-    while True:
-        try:
-            print("--- Scraper run started ---", flush=True)
-            asyncio.run(scrape(username, password))
-        except Exception as e:
-            print(f"Error in periodic scrape: {e}", flush=True)
-        print("Waiting 120 seconds before next scrape...", flush=True)
-        time.sleep(120)
\ No newline at end of file
+    on_record = ndjson_record_writer(records_stream) if records_stream else None
+    asyncio.run(scrape_periodically(username, password, on_record=on_record))
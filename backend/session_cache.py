@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import base64
+import re
+
+# Per-user Playwright storage_state cache so scrapes and assignments can skip
+# the Keycloak username/password + OTP flow while the session is still valid.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SESSIONS_DIR = os.path.join(BASE_DIR, 'sessions')
+TOKEN_FILE = os.path.join(BASE_DIR, 'token.json')
+
+# Treat a session as expired this many seconds before the JWT says so
+SESSION_EXPIRY_MARGIN = int(os.environ.get('SESSION_EXPIRY_MARGIN', 120))
+# Upper bound for sessions saved without a token we can read `exp` from
+SESSION_MAX_AGE = int(os.environ.get('SESSION_MAX_AGE', 8 * 3600))
+
+SSO_HOST = 'sso.earthlink.iq'
+
+
+def jwt_exp(token):
+    """Return the `exp` claim of a JWT as a unix timestamp, or None."""
+    if not token or token.count('.') < 2:
+        return None
+    payload = token.split('.')[1]
+    payload += '=' * (-len(payload) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload.encode('ascii')))
+    except Exception:
+        return None
+    exp = claims.get('exp')
+    return int(exp) if isinstance(exp, (int, float)) else None
+
+
+def load_token_file():
+    if not os.path.exists(TOKEN_FILE):
+        return None
+    try:
+        with open(TOKEN_FILE, 'r') as f:
+            return json.load(f).get('token')
+    except Exception:
+        return None
+
+
+def is_sso_url(url):
+    return bool(url) and SSO_HOST in url
+
+
+def _state_path(username):
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', username)
+    return os.path.join(SESSIONS_DIR, f'{safe}.json')
+
+
+def _read(username):
+    path = _state_path(username)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[Session] Failed to read cached session for {username}: {e}", flush=True)
+        return None
+
+
+def session_expires_at(entry):
+    exp = entry.get('token_exp')
+    if not exp:
+        exp = jwt_exp(load_token_file())
+    if not exp:
+        exp = entry.get('saved_at', 0) + SESSION_MAX_AGE
+    return exp
+
+
+def load_state(username):
+    """Return the cached storage_state for username if it is still valid."""
+    entry = _read(username)
+    if not entry or not entry.get('storage_state'):
+        return None
+    remaining = session_expires_at(entry) - time.time()
+    if remaining <= SESSION_EXPIRY_MARGIN:
+        print(f"[Session] Cached session for {username} expired, full login required.", flush=True)
+        return None
+    print(f"[Session] Reusing cached session for {username} ({int(remaining)}s left).", flush=True)
+    return entry['storage_state']
+
+
+def save_state(username, storage_state, token=None):
+    os.makedirs(SESSIONS_DIR, exist_ok=True)
+    entry = {
+        'username': username,
+        'saved_at': int(time.time()),
+        'token_exp': jwt_exp(token),
+        'storage_state': storage_state,
+    }
+    path = _state_path(username)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+    print(f"[Session] Saved session for {username}.", flush=True)
+
+
+def invalidate(username):
+    path = _state_path(username)
+    if os.path.exists(path):
+        os.remove(path)
+        print(f"[Session] Invalidated cached session for {username}.", flush=True)
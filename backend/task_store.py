@@ -0,0 +1,176 @@
+import os
+import time
+import sqlite3
+import threading
+
+# SQLite (WAL) store for scraped boards: one upsert per scrape, indexed reads
+# for the API instead of re-parsing the newest scraped_*.csv on every request.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get('TASK_DB_PATH', os.path.join(BASE_DIR, 'tasks.db'))
+# Scrape run history kept per user
+RUNS_TO_KEEP = int(os.environ.get('TASK_DB_RUNS_TO_KEEP', 500))
+
+# Scraped column title -> API column key
+COLUMN_KEYS = {'New': 'NEW', 'Pending': 'Pending', 'In Progress': 'In Progress'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scrape_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    started_at REAL,
+    finished_at REAL NOT NULL,
+    task_count INTEGER NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scrape_runs_username ON scrape_runs(username, id);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    username TEXT NOT NULL,
+    task_key TEXT NOT NULL,
+    uuid TEXT,
+    column_name TEXT NOT NULL,
+    case_number TEXT,
+    title TEXT,
+    fbg TEXT,
+    card_text TEXT,
+    position INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (username, task_key)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_uuid ON tasks(uuid);
+
+CREATE TABLE IF NOT EXISTS messages (
+    username TEXT NOT NULL,
+    task_key TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    sender TEXT,
+    message TEXT,
+    date TEXT,
+    PRIMARY KEY (username, task_key, seq)
+);
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def get_connection():
+    """Per-thread connection; WAL lets API reads run alongside scraper writes."""
+    global _initialized
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with _init_lock:
+            if not _initialized:
+                conn.executescript(SCHEMA)
+                _initialized = True
+        _local.conn = conn
+    return conn
+
+
+def task_key(task):
+    return task.get('uuid') or f"case:{task.get('CaseNumber', '')}"
+
+
+def save_scrape(username, rows, started_at=None, status='ok'):
+    """Upsert one scrape's cards for username and drop cards no longer on the board."""
+    conn = get_connection()
+    now = time.time()
+    with conn:
+        cur = conn.execute(
+            'INSERT INTO scrape_runs (username, started_at, finished_at, task_count, status) VALUES (?, ?, ?, ?, ?)',
+            (username, started_at, now, len(rows), status),
+        )
+        run_id = cur.lastrowid
+        for position, row in enumerate(rows):
+            key = task_key(row)
+            conn.execute(
+                '''INSERT INTO tasks (username, task_key, uuid, column_name, case_number, title, fbg, card_text, position, run_id, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(username, task_key) DO UPDATE SET
+                       uuid=excluded.uuid, column_name=excluded.column_name, case_number=excluded.case_number,
+                       title=excluded.title, fbg=excluded.fbg, card_text=excluded.card_text,
+                       position=excluded.position, run_id=excluded.run_id, updated_at=excluded.updated_at''',
+                (username, key, row.get('uuid'), row.get('Column', ''), row.get('CaseNumber'), row.get('Title'),
+                 row.get('FBG'), row.get('CardText'), position, run_id, now),
+            )
+            conn.execute('DELETE FROM messages WHERE username = ? AND task_key = ?', (username, key))
+            conn.executemany(
+                'INSERT INTO messages (username, task_key, seq, sender, message, date) VALUES (?, ?, ?, ?, ?, ?)',
+                [(username, key, seq, m.get('sender', ''), m.get('message', ''), m.get('date', ''))
+                 for seq, m in enumerate(row.get('messages') or [])],
+            )
+        conn.execute(
+            'DELETE FROM messages WHERE username = ? AND task_key IN (SELECT task_key FROM tasks WHERE username = ? AND run_id != ?)',
+            (username, username, run_id),
+        )
+        conn.execute('DELETE FROM tasks WHERE username = ? AND run_id != ?', (username, run_id))
+        conn.execute(
+            'DELETE FROM scrape_runs WHERE username = ? AND id <= ?',
+            (username, run_id - RUNS_TO_KEEP),
+        )
+    return run_id
+
+
+def _messages_by_key(conn, username):
+    result = {}
+    for m in conn.execute(
+        'SELECT task_key, sender, message, date FROM messages WHERE username = ? ORDER BY task_key, seq',
+        (username,),
+    ):
+        result.setdefault(m['task_key'], []).append({'sender': m['sender'], 'message': m['message'], 'date': m['date']})
+    return result
+
+
+def get_tasks(username):
+    """Scraped cards for username in board order, in the scraper's row shape."""
+    conn = get_connection()
+    messages = _messages_by_key(conn, username)
+    tasks = []
+    for row in conn.execute('SELECT * FROM tasks WHERE username = ? ORDER BY position', (username,)):
+        tasks.append({
+            'Column': row['column_name'],
+            'CaseNumber': row['case_number'],
+            'Title': row['title'],
+            'FBG': row['fbg'],
+            'CardText': row['card_text'],
+            'uuid': row['uuid'],
+            'messages': messages.get(row['task_key'], []),
+        })
+    return tasks
+
+
+def get_columns(username):
+    columns = {key: [] for key in COLUMN_KEYS.values()}
+    for task in get_tasks(username):
+        key = COLUMN_KEYS.get(task['Column'])
+        if key:
+            task['has_new_message'] = len(task['messages']) > 0
+            columns[key].append(task)
+    return columns
+
+
+def summarize_messages(tasks):
+    result = {}
+    for task in tasks:
+        messages = task.get('messages') or []
+        result[task['CaseNumber']] = {
+            'messages': messages,
+            'uuid': task['uuid'],
+            'last_message': messages[-1].get('message') if messages else None,
+            'last_message_date': messages[-1].get('date') if messages else None,
+        }
+    return result
+
+
+def latest_run(username):
+    row = get_connection().execute(
+        'SELECT * FROM scrape_runs WHERE username = ? ORDER BY id DESC LIMIT 1', (username,)
+    ).fetchone()
+    return dict(row) if row else None
@@ -0,0 +1,197 @@
+import os
+import json
+import gzip
+import time
+import bisect
+import hashlib
+import threading
+from form_cache import LRU
+
+# Saved form templates (/api/save-form-template), content-addressed: each
+# distinct form is stored once as gzipped compact JSON under
+# objects/<hash[:2]>/<hash>.json.gz, and names point at hashes through an
+# append-only index.log replayed into memory at startup. Reads come from an
+# LRU of serialized bodies and carry the hash as their ETag; listings read
+# (and optionally page through) a sorted in-memory name list instead of
+# scanning the directory.
+# Legacy <name>.json files in the same directory are imported on first start.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.environ.get("FORM_TEMPLATES_DIR", os.path.join(BASE_DIR, "form-templates"))
+TEMPLATE_CACHE_SIZE = int(os.environ.get("FORM_TEMPLATE_STORE_CACHE_SIZE", 256))
+TEMPLATE_LIST_MAX_LIMIT = 5000
+# Rewrite index.log once it holds this many times more lines than live names
+INDEX_COMPACT_RATIO = 2
+
+
+def content_hash(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def serialize(data):
+    """Canonical compact JSON bytes, so equal forms hash equally."""
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+class TemplateStore:
+    def __init__(self, root=TEMPLATES_DIR, cache_size=TEMPLATE_CACHE_SIZE):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.index_path = os.path.join(root, "index.log")
+        self.index = {}          # name -> {hash, saved_at}
+        self._names = []         # sorted names, for paging
+        self._index_lines = 0
+        self._bodies = LRU(cache_size)  # hash -> serialized JSON bytes
+        self._lock = threading.Lock()
+        self.counters = {"hit": 0, "miss": 0, "saved": 0, "deduplicated": 0}
+        self._load_index()
+
+    # --- index ---
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-append
+                        continue
+                    self._index_lines += 1
+                    if entry.get("hash"):
+                        self.index[entry["name"]] = {"hash": entry["hash"], "saved_at": entry.get("saved_at")}
+                    else:
+                        self.index.pop(entry["name"], None)
+        self._import_legacy()
+        self._names = sorted(self.index)
+        print(f"[Templates] Indexed {len(self.index)} saved template(s), {self._distinct()} distinct.", flush=True)
+
+    def _import_legacy(self):
+        if not os.path.isdir(self.root):
+            return
+        imported = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_file() or not entry.name.endswith(".json"):
+                continue
+            name = entry.name[:-len(".json")]
+            if name in self.index:
+                continue
+            try:
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[Templates] Skipping unreadable legacy template {entry.name}: {e}", flush=True)
+                continue
+            self._save_locked(name, data, saved_at=entry.stat().st_mtime)
+            imported += 1
+        if imported:
+            print(f"[Templates] Imported {imported} legacy template file(s).", flush=True)
+
+    def _append_index(self, record):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._index_lines += 1
+        if self._index_lines > INDEX_COMPACT_RATIO * max(len(self.index), 1) + 100:
+            self._compact_index()
+
+    def _compact_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for name, entry in self.index.items():
+                f.write(json.dumps({"name": name, **entry}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.index_path)
+        self._index_lines = len(self.index)
+
+    def _distinct(self):
+        return len({entry["hash"] for entry in self.index.values()})
+
+    # --- objects ---
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.json.gz")
+
+    def _write_object(self, digest, body):
+        """Write body under its hash unless it exists; True when it was already stored."""
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        return False
+
+    # --- public API ---
+
+    def _save_locked(self, name, data, saved_at=None):
+        body = serialize(data)
+        digest = content_hash(body)
+        existed = self._write_object(digest, body)
+        record = {"name": name, "hash": digest, "saved_at": saved_at or time.time()}
+        is_new_name = name not in self.index
+        self.index[name] = {"hash": digest, "saved_at": record["saved_at"]}
+        self._append_index(record)
+        if is_new_name:
+            bisect.insort(self._names, name)
+        self._bodies.put(digest, body)
+        self.counters["saved"] += 1
+        if existed:
+            self.counters["deduplicated"] += 1
+        return {"hash": digest, "deduplicated": existed, "path": self._object_path(digest)}
+
+    def save(self, name, data):
+        """Store data under name; returns {hash, deduplicated, path}."""
+        with self._lock:
+            return self._save_locked(name, data)
+
+    def get(self, name):
+        """(body bytes, hash) for name, or None. body is the canonical JSON."""
+        with self._lock:
+            entry = self.index.get(name)
+            if entry is None:
+                return None
+            digest = entry["hash"]
+            body = self._bodies.get(digest)
+        if body is not None:
+            self.counters["hit"] += 1
+            return body, digest
+        self.counters["miss"] += 1
+        try:
+            with gzip.open(self._object_path(digest), "rb") as f:
+                body = f.read()
+        except OSError as e:
+            print(f"[Templates] Object {digest} for {name} is missing: {e}", flush=True)
+            return None
+        with self._lock:
+            self._bodies.put(digest, body)
+        return body, digest
+
+    def etag(self, name):
+        with self._lock:
+            entry = self.index.get(name)
+            return entry["hash"] if entry else None
+
+    def list(self, offset=0, limit=None, prefix=None):
+        """Saved names in sorted order: (names, total matching). limit=None returns all."""
+        offset = max(0, offset)
+        if limit is not None:
+            limit = max(1, min(limit, TEMPLATE_LIST_MAX_LIMIT))
+        with self._lock:
+            names = self._names
+            if prefix:
+                start = bisect.bisect_left(names, prefix)
+                end = bisect.bisect_left(names, prefix + "\uffff")
+            else:
+                start, end = 0, len(names)
+            stop = end if limit is None else min(end, start + offset + limit)
+            page = names[start + offset:stop]
+        return page, end - start
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, names=len(self.index), distinct=self._distinct(), cached=len(self._bodies))
+
+
+template_store = TemplateStore()
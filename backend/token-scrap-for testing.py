@@ -3,39 +3,52 @@ import sys
 import json
 from pathlib import Path
 from playwright.sync_api import sync_playwright
+import session_cache
+import readiness
+import resource_policy
 
 # Usage: python token-scrap.py <username> <password>
 
 
+def sso_form_login(page, username, password):
+    print("Filling username...", flush=True)
+    page.fill('//*[@id="username"]', username)
+    print("Filling password...", flush=True)
+    page.fill('//*[@id="password"]', password)
+    print("Clicking sign in...", flush=True)
+    page.click('//*[@id="kc-form-buttons"]')
+    print("Waiting for OTP/password page...", flush=True)
+    try:
+        page.wait_for_url("**/login-actions/authenticate?*", timeout=30000)
+        print("Filling OTP/password again...", flush=True)
+        page.fill('//*[@id="pi_otp"]', password)
+        print("Clicking confirm...", flush=True)
+        page.click('//*[@id="kc-login"]')
+        print("Waiting for page to load after confirm...", flush=True)
+        readiness.wait_url_sync(page, "login.redirect", lambda url: not session_cache.is_sso_url(url), timeout=30000)
+    except Exception:
+        print("No OTP/password page detected.", flush=True)
+    print("Login and initial navigation complete.", flush=True)
+
+
 def get_token(username, password):
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
+        storage_state = session_cache.load_state(username)
+        context = browser.new_context(storage_state=storage_state)
+        page = context.new_page()
+        resource_policy.apply_sync(context, page, "token")
+        readiness.track_api(page)
         LOGIN_URL = "https://sso.earthlink.iq/auth/realms/elcld.ai/protocol/openid-connect/auth?response_type=code&client_id=fms-msp&redirect_uri=https%3A%2F%2Fmsp.go2field.iq%2Fboard%2Fmy-unit-tasks&scope=openid"
         print("Navigating to login page...", flush=True)
         page.goto(LOGIN_URL)
-        print("Filling username...", flush=True)
-        page.fill('//*[@id="username"]', username)
-        print("Filling password...", flush=True)
-        page.fill('//*[@id="password"]', password)
-        print("Clicking sign in...", flush=True)
-        page.click('//*[@id="kc-form-buttons"]')
-        print("Waiting for OTP/password page...", flush=True)
-        try:
-            page.wait_for_url("**/login-actions/authenticate?*", timeout=30000)
-            print("Filling OTP/password again...", flush=True)
-            page.fill('//*[@id="pi_otp"]', password)
-            print("Clicking confirm...", flush=True)
-            page.click('//*[@id="kc-login"]')
-            print("Waiting for page to load after confirm...", flush=True)
-            page.wait_for_timeout(5000)
-        except Exception:
-            print("No OTP/password page detected.", flush=True)
-        print("Login and initial navigation complete.", flush=True)
+        if page.query_selector('#username'):
+            sso_form_login(page, username, password)
+        else:
+            print("Cached session still authenticated, skipping login.", flush=True)
         # Navigate to board and wait for columns
         board_url = "https://msp.go2field.iq/board/a22c39cb-093c-d83e-7dd1-a8c7a5d0fa7b"
         page.goto(board_url)
-        page.wait_for_timeout(2000)
         print("Waiting for My Unit Tasks button in sidebar...", flush=True)
         my_unit_tasks_button = page.wait_for_selector('xpath=//*[@id="app_container"]/app-main-layout/div/div[2]/app-board-view/div/div[1]/div[4]/div[3]/a[2]', timeout=15000)
         print("My Unit Tasks button found. Clicking...", flush=True)
@@ -43,7 +56,7 @@ def get_token(username, password):
         print("My Unit Tasks button clicked. Waiting for columns to appear...", flush=True)
         page.wait_for_selector('.board-col', timeout=15000)
         print("Columns appeared. Waiting for content to load...", flush=True)
-        page.wait_for_timeout(6000)
+        readiness.wait_board_ready_sync(page)
         # Debug: print all sessionStorage keys and values
         print("--- sessionStorage contents after navigation ---")
         ss_dump = page.evaluate('''() => {
@@ -95,6 +108,10 @@ def get_token(username, password):
                     token = cookie['value']
                     print('Token found in KEYCLOAK_IDENTITY cookie')
                     break
+        try:
+            session_cache.save_state(username, context.storage_state(), token)
+        except Exception as e:
+            print(f"[Session] Failed to save session for {username}: {e}", flush=True)
         browser.close()
         return token
 
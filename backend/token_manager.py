@@ -0,0 +1,161 @@
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import session_cache
+
+# Per-user FMS API tokens held in memory. Scrapes publish the token they
+# extract; callers get a token that is valid for at least TOKEN_MIN_TTL
+# seconds. Within TOKEN_REFRESH_AHEAD of `exp` a background refresh runs
+# through the registered refresher (a board reload in the user's pooled
+# browser context, not a full scrape), and concurrent callers share one
+# refresh per user. Only a token expiring later than the cached one is
+# accepted; otherwise the user backs off before the next attempt.
+
+TOKEN_REFRESH_AHEAD = int(os.environ.get("TOKEN_REFRESH_AHEAD", 300))
+TOKEN_MIN_TTL = int(os.environ.get("TOKEN_MIN_TTL", 30))
+TOKEN_REFRESH_TIMEOUT = int(os.environ.get("TOKEN_REFRESH_TIMEOUT", 90))
+# A refresh that yields no newer token is retried after this delay, doubled
+# per consecutive failure up to the cap, instead of on every get()
+TOKEN_REFRESH_BACKOFF = (60, 900)
+# Tokens without a readable `exp` are trusted for this long after publication
+TOKEN_DEFAULT_LIFETIME = 1800
+
+
+class TokenManager:
+    def __init__(self):
+        self.tokens = {}  # username -> {token, exp, updated_at}
+        self.default_user = None
+        self.refresher = None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._rejected = {}      # username -> token upstream answered 401 for
+        self._failures = {}      # username -> consecutive refreshes without a newer token
+        self._next_attempt = {}  # username -> no refresh before this time
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="token-refresh")
+        self.counters = {"refreshes": 0, "refresh_failures": 0, "waited": 0}
+        # Seed the shared token from the last scrape of a previous process
+        token = session_cache.load_token_file()
+        if token:
+            self.put(None, token)
+
+    def set_refresher(self, refresher):
+        """refresher(username) -> new token or None; runs on a background thread."""
+        self.refresher = refresher
+
+    def put(self, username, token):
+        """Publish a freshly extracted token for username (None = shared default).
+
+        Returns False, keeping the cached token, when token was rejected
+        upstream or does not expire later than the cached one.
+        """
+        if not token:
+            return False
+        exp = session_cache.jwt_exp(token) or time.time() + TOKEN_DEFAULT_LIFETIME
+        with self._lock:
+            current = self.tokens.get(username)
+            if token == self._rejected.get(username):
+                return False
+            if current and (token == current["token"] or exp <= current["exp"]):
+                return False
+            self.tokens[username] = {"token": token, "exp": exp, "updated_at": time.time()}
+            if username:
+                self.default_user = username
+                self.tokens[None] = self.tokens[username]
+            return True
+
+    def invalidate(self, username=None):
+        """Drop a token upstream rejected (401) so the next get() refreshes it."""
+        with self._lock:
+            entry = self.tokens.get(username)
+            if entry:
+                self._rejected[username] = entry["token"]
+                entry["exp"] = 0
+            # A rejection is new information; allow an immediate refresh
+            self._next_attempt.pop(username or self.default_user, None)
+
+    def _entry(self, username):
+        with self._lock:
+            entry = self.tokens.get(username)
+            return dict(entry) if entry else None
+
+    def _refresh(self, username):
+        """Single-flight refresh for username; returns a Future resolving to the token or None."""
+        target = username or self.default_user
+        with self._lock:
+            future = self._inflight.get(target)
+            if future is not None:
+                return future
+            future = self._inflight[target] = Future()
+
+        def run():
+            token = None
+            before = self._entry(target)
+            before_exp = before["exp"] if before else 0
+            try:
+                if self.refresher and target:
+                    self.counters["refreshes"] += 1
+                    fresh = self.refresher(target)
+                    if fresh:
+                        self.put(target, fresh)
+                    after = self._entry(target)
+                    if after and after["exp"] > before_exp:
+                        token = after["token"]
+            except Exception as e:
+                print(f"[Token] Refresh for {target} failed: {e}", flush=True)
+            finally:
+                with self._lock:
+                    if token:
+                        self._failures.pop(target, None)
+                        self._next_attempt.pop(target, None)
+                    else:
+                        self.counters["refresh_failures"] += 1
+                        failures = self._failures[target] = self._failures.get(target, 0) + 1
+                        first, cap = TOKEN_REFRESH_BACKOFF
+                        self._next_attempt[target] = time.time() + min(cap, first * 2 ** (failures - 1))
+                    self._inflight.pop(target, None)
+                if not token:
+                    print(f"[Token] No newer token for {target}, backing off.", flush=True)
+                future.set_result(token)
+
+        self._background.submit(run)
+        return future
+
+    def get(self, username=None):
+        """A token valid for at least TOKEN_MIN_TTL seconds, or None when none can be had."""
+        entry = self._entry(username) or (self._entry(None) if username else None)
+        now = time.time()
+        remaining = entry["exp"] - now if entry else 0
+        if remaining > TOKEN_REFRESH_AHEAD:
+            return entry["token"]
+        usable = entry["token"] if remaining > TOKEN_MIN_TTL else None
+        with self._lock:
+            backing_off = now < self._next_attempt.get(username or self.default_user, 0)
+        if backing_off:
+            return usable
+        future = self._refresh(username)
+        if usable:
+            # Still usable: hand it out and let the refresh land in the background
+            return usable
+        self.counters["waited"] += 1
+        try:
+            return future.result(timeout=TOKEN_REFRESH_TIMEOUT)
+        except Exception:
+            return None
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                "default_user": self.default_user,
+                "inflight": list(self._inflight),
+                "backoff": {(u or "_default"): round(t - now) for u, t in self._next_attempt.items() if t > now},
+                "tokens": {
+                    (u or "_default"): {"expires_in": round(e["exp"] - now), "updated_at": e["updated_at"]}
+                    for u, e in self.tokens.items()
+                },
+                **self.counters,
+            }
+
+
+token_manager = TokenManager()
@@ -5,6 +5,46 @@ import { FaRegCommentDots, FaWhatsapp, FaTelegramPlane } from "react-icons/fa";
 
 const COLUMN_NAMES = ["NEW", "Pending", "In Progress"];
 const REFRESH_INTERVAL = 120; // seconds
+// Scraped column title -> board column key
+const COLUMN_KEYS: { [title: string]: string } = { New: "NEW", Pending: "Pending", "In Progress": "In Progress" };
+
+const taskKey = (task: any) => task.uuid || `case:${task.CaseNumber}`;
+
+// Same shape as /check_task_messages, built from the tasks pushed over SSE
+const messagesFromColumns = (columns: any) => {
+  const result: any = {};
+  Object.values(columns || {}).forEach((tasks: any) => {
+    (tasks || []).forEach((task: any) => {
+      const messages = task.messages || [];
+      result[task.CaseNumber] = {
+        messages,
+        uuid: task.uuid,
+        last_message: messages.length ? messages[messages.length - 1].message : null,
+        last_message_date: messages.length ? messages[messages.length - 1].date : null,
+      };
+    });
+  });
+  return result;
+};
+
+const JOB_POLL_INTERVAL = 1000; // ms
+const JOB_FINISHED = ["done", "failed", "cancelled", "timeout"];
+const JOB_MAX_WAIT = 5 * 60 * 1000; // ms; stop polling a job that never finishes
+
+class JobWaitTimeout extends Error {}
+
+// Polls an assignment job from /add_technician until it reaches a final status
+const waitForJob = async (apiUrl: string, job: any) => {
+  const deadline = Date.now() + JOB_MAX_WAIT;
+  while (!JOB_FINISHED.includes(job.status)) {
+    if (Date.now() > deadline) throw new JobWaitTimeout(`Job ${job.id} still ${job.status}`);
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+    const res = await fetch(`${apiUrl}/api/jobs/${job.id}`);
+    if (!res.ok) throw new Error(`Job status ${res.status}`);
+    job = await res.json();
+  }
+  return job;
+};
 
 const FMSController = () => {
   // Form template selector state (shared for all cards)
@@ -55,6 +95,8 @@ const FMSController = () => {
   const [workers, setWorkers] = useState<string[]>([]);
   const navigate = useNavigate();
   const pollingRef = useRef<any>(0);
+  // True while the /events stream is connected; polling only runs as a fallback
+  const sseConnectedRef = useRef(false);
 
   // Fetch workers list from backend
   useEffect(() => {
@@ -127,9 +169,93 @@ const FMSController = () => {
       setLoading(false);
     };
     pollForTasks();
+
+    // Live updates: the backend pushes only what changed after each scraped card
+    let eventSource: EventSource | null = null;
+    if (typeof window !== "undefined" && "EventSource" in window) {
+      eventSource = new EventSource(`${API_URL}/events?username=${encodeURIComponent(username)}`);
+      eventSource.onopen = () => {
+        sseConnectedRef.current = true;
+      };
+      eventSource.onerror = () => {
+        // EventSource reconnects on its own and resumes from the last event id
+        sseConnectedRef.current = false;
+      };
+      const removeTask = (cols: any, key: string) => {
+        const next: any = {};
+        Object.entries(cols).forEach(([name, tasks]: any) => {
+          next[name] = tasks.filter((t: any) => taskKey(t) !== key);
+        });
+        return next;
+      };
+      eventSource.addEventListener("snapshot", (e: MessageEvent) => {
+        const data = JSON.parse(e.data);
+        const cols = data.columns || { NEW: [], Pending: [], "In Progress": [] };
+        setColumns(cols);
+        setTaskMessages(messagesFromColumns(cols));
+        setLoading(false);
+      });
+      const upsertTask = (e: MessageEvent) => {
+        const { task } = JSON.parse(e.data);
+        const colKey = COLUMN_KEYS[task.Column];
+        if (!colKey) return;
+        setColumns((prev: any) => {
+          const key = taskKey(task);
+          const current = prev[colKey] || [];
+          if (current.some((t: any) => taskKey(t) === key)) {
+            return { ...prev, [colKey]: current.map((t: any) => (taskKey(t) === key ? task : t)) };
+          }
+          const next = removeTask(prev, key);
+          next[colKey] = [...(next[colKey] || []), task];
+          return next;
+        });
+        if (e.type === "task_added" && task.messages?.length) {
+          // New cards carry their notes inline; later notes arrive as "messages" events
+          setTaskMessages((prev: any) => ({ ...prev, ...messagesFromColumns({ [colKey]: [task] }) }));
+        }
+      };
+      eventSource.addEventListener("task_added", upsertTask);
+      eventSource.addEventListener("task_moved", upsertTask);
+      eventSource.addEventListener("task_updated", upsertTask);
+      eventSource.addEventListener("task_removed", (e: MessageEvent) => {
+        const data = JSON.parse(e.data);
+        setColumns((prev: any) => removeTask(prev, taskKey(data)));
+        setTaskMessages((prev: any) => {
+          const next = { ...prev };
+          delete next[data.CaseNumber];
+          return next;
+        });
+      });
+      eventSource.addEventListener("messages", (e: MessageEvent) => {
+        const data = JSON.parse(e.data);
+        setTaskMessages((prev: any) => {
+          const existing = prev[data.CaseNumber]?.messages || [];
+          const messages = data.replace ? data.new_messages : [...existing, ...data.new_messages];
+          const last = messages[messages.length - 1];
+          return {
+            ...prev,
+            [data.CaseNumber]: {
+              messages,
+              uuid: data.uuid,
+              last_message: last ? last.message : null,
+              last_message_date: last ? last.date : null,
+            },
+          };
+        });
+        if (data.new_messages.length > 0) {
+          setNotificationMsg(`New message in task ${data.CaseNumber}!`);
+          setShowNotification(true);
+          setTimeout(() => setShowNotification(false), 4000);
+        }
+      });
+      eventSource.addEventListener("scrape_finished", () => {
+        setTimer(REFRESH_INTERVAL);
+      });
+    }
+
     setTimer(REFRESH_INTERVAL);
     const interval = setInterval(() => {
-      fetchColumns();
+      if (!sseConnectedRef.current) fetchColumns();
       setTimer(REFRESH_INTERVAL);
     }, REFRESH_INTERVAL * 1000);
     const timerInterval = setInterval(() => {
@@ -137,6 +263,8 @@ const FMSController = () => {
     }, 1000);
     return () => {
       abortController.abort();
+      if (eventSource) eventSource.close();
+      sseConnectedRef.current = false;
       clearInterval(interval);
       clearInterval(timerInterval);
     };
@@ -331,11 +459,14 @@ const FMSController = () => {
                                           body: JSON.stringify({
                                             task_uuid: task.uuid,
                                             worker_name: workerName,
-                                            case_number: task.CaseNumber
+                                            case_number: task.CaseNumber,
+                                            username: localStorage.getItem("username")
                                           })
                                         });
-                                        const data = await res.json();
-                                        if (res.ok && data.success) {
+                                        const queued = await res.json();
+                                        const job = res.ok ? await waitForJob(API_URL, queued) : null;
+                                        const data = job ? job.result || {} : queued;
+                                        if (job && job.status === "done" && data.success) {
                                           toast({
                                             title: "Technician assigned",
                                             description: `Successfully assigned ${workerName} to task ${task.CaseNumber}`,
@@ -352,11 +483,19 @@ const FMSController = () => {
                                           });
                                         }
                                       } catch (err) {
-                                        toast({
-                                          title: "Network error",
-                                          description: "Could not reach backend. Try again.",
-                                          variant: "destructive"
-                                        });
+                                        if (err instanceof JobWaitTimeout) {
+                                          toast({
+                                            title: "Assignment timed out",
+                                            description: `No result for task ${task.CaseNumber} after ${JOB_MAX_WAIT / 60000} minutes. Check the task before retrying.`,
+                                            variant: "destructive"
+                                          });
+                                        } else {
+                                          toast({
+                                            title: "Network error",
+                                            description: "Could not reach backend. Try again.",
+                                            variant: "destructive"
+                                          });
+                                        }
                                       } finally {
                                         task.isApplying = false;
                                         if (typeof window !== "undefined") window.dispatchEvent(new Event("worker-select"));
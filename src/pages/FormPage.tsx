@@ -11,8 +11,14 @@ const WhiteBox: React.FC<{ title: string; children: React.ReactNode }> = ({ titl
   </div>
 );
 
-// Helper: get the real form template (handles formTemplate stringified JSON)
+const usernameQuery = () => {
+  const username = localStorage.getItem("username");
+  return username ? `?username=${encodeURIComponent(username)}` : "";
+};
+
+// Helper: get the real form template (compiled form, stringified formTemplate or a raw template)
 function extractFormTemplate(data: any) {
+  if (data && Array.isArray(data.components)) return data;
   if (data && typeof data.formTemplate === "string") {
     try {
       return JSON.parse(data.formTemplate);
@@ -20,7 +26,6 @@ function extractFormTemplate(data: any) {
       return null;
     }
   }
-  if (data && data.components) return data;
   return null;
 }
 
@@ -41,7 +46,8 @@ const FormPage: React.FC = () => {
         if (taskId && taskId.endsWith('.json')) {
           response = await fetch(`/api/form-template/${taskId}`);
         } else {
-          response = await fetch(`/api/form/${taskId}`);
+          // Compiled on the server: pruned components with `required` hoisted
+          response = await fetch(`/api/form/${taskId}/compiled${usernameQuery()}`);
         }
         if (!response.ok) throw new Error("Failed to fetch form template");
         const data = await response.json();
@@ -67,6 +73,17 @@ const FormPage: React.FC = () => {
         alert("Please enter a template name before saving.");
         return;
       }
+      if (taskId && !taskId.endsWith('.json')) {
+        const check = await fetch(`/api/form/${taskId}/validate${usernameQuery()}`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ formData }),
+        });
+        if (check.ok) {
+          const { errors } = await check.json();
+          if (errors?.length && !window.confirm(`${errors.map((e: any) => e.error).join("\n")}\n\nSave anyway?`)) return;
+        }
+      }
       const response = await fetch("/api/save-form-template", {
         method: "POST",
         headers: { "Content-Type": "application/json" },